@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Johannes Gäding
+"""
+
+import functools
+
+import numpy
+
+import system
+
+#---------------------------------------------------
+# Positions, atom types and box of the selected frame of a trajectory.
+# xyz_trajectory frames contain no box, so it has to be provided.
+# For lammpstrj the box is taken from cell() and scaled coordinates
+# (xs ys zs) are converted to absolute ones. Further dump columns are
+# parsed in the same pass and returned as dict {name: numpy.array(N)}.
+#---------------------------------------------------
+
+coordinate_columns = (('x', 'y', 'z'), ('xu', 'yu', 'zu'), ('xs', 'ys', 'zs'), ('xsu', 'ysu', 'zsu'))
+
+def frame_atoms(frame, box=None, type_column='type', columns=()):
+    if hasattr(frame, 'positions'):
+        if box is None:
+            raise ValueError('xyz trajectories contain no box. Please provide the box as (3,) or (3,2) array.')
+        if len(columns) > 0:
+            raise ValueError('xyz trajectories contain no columns besides atom types and positions.')
+        return frame.positions(), frame.atom_types(), box, dict()
+    names = frame.columns()
+    for xyz in coordinate_columns:
+        if all(name in names for name in xyz):
+            break
+    else:
+        raise ValueError('No coordinate columns found in {names}.'.format(names=names))
+    cell = numpy.array(frame.cell())[:,:2]
+    selected = list(xyz)
+    if type_column in names:
+        selected.append(type_column)
+    selected += [name for name in columns if name not in selected]
+    record = frame.data(columns=selected, dtype=frame.dtypes())
+    positions = numpy.column_stack([record[name] for name in xyz]).astype(float)
+    if xyz[0].startswith('xs'):
+        positions = cell[:,0] + positions * (cell[:,1] - cell[:,0])
+    types = record[type_column] if type_column in names else None
+    if box is None:
+        box = cell.tolist()
+    return positions, types, box, {name: record[name] for name in columns}
+
+#---------------------------------------------------
+# Radial distribution function g(r) of a lammpstrj or xyz_trajectory.
+#
+# Pairs up to r_max are found with system.neighbors() frame by frame and
+# only their histogram (bincount of the bin index) is kept. Each frame is normalized with its own box
+# volume, so boxes may change during the run. The frames are histogrammed
+# in parallel with map_frames() and summed in frame order.
+#
+# pairs     ... None for the total g(r) or list of type pairs, e.g. [(1, 1), (1, 2)]
+# frames    ... frame indices to average over, all frames if None
+# box       ... box of xyz trajectories [lx, ly, lz] or [[xlo, xhi], [ylo, yhi], [zlo, zhi]]
+# n_workers ... processes of map_frames(), all cores if None, 1 runs in this process
+#
+# r_max may not exceed half of the shortest periodic box length of any
+# frame (ValueError), see system.neighbors().
+#
+# Returns the bin centers and g(r) - numpy.array(n_bins) for pairs=None,
+# otherwise a dict {pair: numpy.array(n_bins)}.
+#---------------------------------------------------
+
+def rdf(traj, r_max, bin_width=0.1, pairs=None, frames=None, box=None, pbc=[1,1,1], type_column='type', n_workers=None, chunksize=None):
+    n_bins = int(numpy.ceil(r_max / bin_width - 1e-9))
+    edges = numpy.arange(n_bins + 1) * bin_width
+    keys = ['all'] if pairs is None else [tuple(pair) for pair in pairs]
+    if frames is None:
+        frames = range(traj.n_frames)
+    frames = list(frames)
+    g = {key: numpy.zeros(n_bins) for key in keys}
+    if len(frames) > 0:
+        histogram = functools.partial(_rdf_frame, r_max=r_max, bin_width=bin_width, n_bins=n_bins, keys=keys,
+                                      box=box, pbc=pbc, type_column=type_column)
+        g = traj.map_frames(histogram, n_workers=n_workers, chunksize=chunksize, frames=frames, reduce=_add_histograms)
+        g = {key: g[key] / len(frames) for key in keys}
+    bins = (edges[1:] + edges[:-1]) / 2
+    if pairs is None:
+        return bins, g['all']
+    return bins, g
+
+# Normalized pair histograms of one frame, {key: numpy.array(n_bins)}
+def _rdf_frame(frame, r_max, bin_width, n_bins, keys, box, pbc, type_column):
+    edges = numpy.arange(n_bins + 1) * bin_width
+    shell_volumes = 4 / 3 * numpy.pi * (edges[1:]**3 - edges[:-1]**3)
+    positions, types, frame_box, values = frame_atoms(frame, box=box, type_column=type_column)
+    frame_system = system.system(positions, frame_box, pbc)
+    volume = numpy.prod(frame_system.box_length)
+    neighbor_pairs, distances = frame_system.neighbors(r_max)
+    bin_index = (distances / bin_width).astype(numpy.int64)
+    if keys != ['all']:
+        type_i, type_j = types[neighbor_pairs[:,0]], types[neighbor_pairs[:,1]]
+    g = dict()
+    for key in keys:
+        if key == 'all':
+            n_a = n_b = len(positions)
+            selected = bin_index
+        else:
+            a, b = key
+            n_a, n_b = numpy.sum(types == a), numpy.sum(types == b)
+            if a == b:
+                selected = bin_index[(type_i == a) & (type_j == a)]
+            else:
+                selected = bin_index[((type_i == a) & (type_j == b)) | ((type_i == b) & (type_j == a))]
+        counts = numpy.bincount(selected, minlength=n_bins)[:n_bins]
+        # Unordered pairs of one species are counted once, but each
+        # of the two atoms has the other one as neighbor.
+        if key == 'all' or key[0] == key[1]:
+            counts = 2 * counts
+            n_b = n_b - 1
+        g[key] = numpy.zeros(n_bins)
+        if n_a > 0 and n_b > 0:
+            g[key] = counts * volume / (n_a * n_b * shell_volumes)
+    return g
+
+def _add_histograms(a, b):
+    return {key: a[key] + b[key] for key in a}
+
+#---------------------------------------------------
+# Running mean and variance (Welford) of equally shaped arrays, e.g. one
+# profile per frame. Memory does not grow with the number of updates.
+# Two instances can be combined with merge(), e.g. after a parallel run.
+#---------------------------------------------------
+
+class running_statistics:
+
+    def __init__(self, shape):
+        self.n = 0
+        self.mean = numpy.zeros(shape)
+        self.m2 = numpy.zeros(shape)
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def merge(self, other):
+        n = self.n + other.n
+        if n == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / n
+        self.m2 = self.m2 + other.m2 + delta**2 * self.n * other.n / n
+        self.n = n
+        return self
+
+    def variance(self, ddof=0):
+        if self.n - ddof <= 0:
+            return numpy.full_like(self.mean, numpy.nan)
+        return self.m2 / (self.n - ddof)
+
+    def std(self, ddof=0):
+        return numpy.sqrt(self.variance(ddof))
+
+#---------------------------------------------------
+# Density profile along axis averaged over a lammpstrj or xyz_trajectory.
+#
+# Every frame is binned in one bincount pass. Without min_coord/max_coord
+# the bins span the box of each frame (from cell()), so the bins follow a
+# changing box; their number is set by the first frame. Only running mean
+# and variance per bin are kept.
+#
+# types     ... only atoms of these types, e.g. [1, 2]
+# weights   ... dump column summed per bin instead of counting atoms, e.g. 'mass' or 'q'
+# normalize ... divide by the bin volume of each frame to get a density
+# frames    ... frame indices to average over, all frames if None
+# box       ... box of xyz trajectories [lx, ly, lz] or [[xlo, xhi], [ylo, yhi], [zlo, zhi]]
+#
+# Returns mean and standard deviation per bin and the mean bin centers.
+#---------------------------------------------------
+
+def density_profile(traj, axis, bin_width=0.5, min_coord=None, max_coord=None, types=None, weights=None,
+                    normalize=False, frames=None, box=None, type_column='type'):
+    if frames is None:
+        frames = range(traj.n_frames)
+    columns = () if weights is None else (weights,)
+    statistics = None
+    centers = None
+    for i in frames:
+        positions, atom_types, frame_box, values = frame_atoms(traj[i], box=box, type_column=type_column, columns=columns)
+        frame_system = system.system(positions, frame_box)
+        low = frame_system.box_limits[axis][0] if min_coord is None else min_coord
+        high = frame_system.box_limits[axis][1] if max_coord is None else max_coord
+        if statistics is None:
+            n_bins = max(1, int(round((high - low) / bin_width)))
+            statistics = running_statistics(n_bins)
+            centers = running_statistics(n_bins)
+        width = (high - low) / n_bins
+        selected = numpy.ones(len(positions), dtype=bool)
+        if types is not None:
+            selected = numpy.isin(atom_types, types)
+        index = numpy.floor((positions[:,axis] - low) / width).astype(numpy.int64)
+        selected &= (index >= 0) & (index < n_bins)
+        frame_weights = None if weights is None else numpy.asarray(values[weights], dtype=float)[selected]
+        profile = numpy.bincount(index[selected], weights=frame_weights, minlength=n_bins).astype(float)
+        if normalize:
+            area = numpy.prod([frame_system.box_length[k] for k in range(3) if k != axis])
+            profile /= area * width
+        statistics.update(profile)
+        centers.update(low + (numpy.arange(n_bins) + 0.5) * width)
+    if statistics is None:
+        raise ValueError('No frames selected.')
+    return statistics.mean, statistics.std(), centers.mean
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the lapy3 readers. Run from the repository root, e.g.
+
+    python -m benchmarks.suite --scales 1 2 4 --output results.json
+    python -m benchmarks.bench_frame_index
+
+benchmarks.generators writes the synthetic dumps, logs and fix output
+files they run on.
+"""
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scaling of the frame index of lammpstrj with the number of frames.
+
+Compares the former frame discovery, which recomputed the cumulative sum
+over all frames found so far in every step, with the byte scanner used by
+trajectory.lammpstrj. Trajectories with many small frames are written to a
+temporary directory.
+
+    python -m benchmarks.bench_frame_index [--atoms 5] [--frames 1000 2000 4000 8000 16000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy
+
+import trajectory
+from benchmarks.generators import write_lammpstrj
+
+
+# Frame discovery as it was done before the byte scanner.
+def quadratic_index(path):
+    with open(path) as f:
+        content = f.readlines()
+    timesteps = list()
+    atoms_per_frame = list()
+    line = 0
+    while line < len(content):
+        timesteps.append(int(content[line+1]))
+        atoms_per_frame.append(int(content[line+3]))
+        line = numpy.cumsum(numpy.array(atoms_per_frame)+9)[-1]
+    return timesteps, atoms_per_frame
+
+
+def linear_index(path):
+    with open(path, 'rb') as f:
+        return trajectory._scan_frames(f, 0, 9, 3)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--atoms', type=int, default=5)
+    parser.add_argument('--frames', type=int, nargs='+', default=[1000, 2000, 4000, 8000, 16000])
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>14} {:>12} {:>14}'.format('frames', 'old [s]', 'old [us/frame]', 'new [s]', 'new [us/frame]'))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.lammpstrj')
+        for n_frames in args.frames:
+            write_lammpstrj(path, n_frames, args.atoms)
+            old = timed(quadratic_index, path)
+            new = timed(linear_index, path)
+            print('{:>8} {:>12.4f} {:>14.2f} {:>12.4f} {:>14.2f}'.format(n_frames, old, old / n_frames * 1e6, new, new / n_frames * 1e6))
+
+
+if __name__ == '__main__':
+    main()
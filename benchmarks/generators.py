@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic LAMMPS output for the benchmarks, written offline.
+
+All writers take the output path and the sizes, and are deterministic for
+a given seed. Numbers are formatted as LAMMPS writes them, so parsing cost
+and file size are comparable to real simulation output.
+"""
+
+import numpy
+
+
+# Dump columns with their printf format; further columns are floats.
+dump_formats = {'id': '%d', 'type': '%d', 'mol': '%d', 'ix': '%d', 'iy': '%d', 'iz': '%d'}
+
+
+def write_lammpstrj(path, n_frames, n_atoms, columns=('id', 'type', 'x', 'y', 'z'), box=20.0, seed=0):
+    rng = numpy.random.default_rng(seed)
+    fmt = ' '.join(dump_formats.get(column, '%.6g') for column in columns)
+    ids = numpy.arange(1, n_atoms + 1)
+    with open(path, 'w') as f:
+        for frame in range(n_frames):
+            f.write('ITEM: TIMESTEP\n{}\nITEM: NUMBER OF ATOMS\n{}\n'.format(frame * 1000, n_atoms))
+            f.write('ITEM: BOX BOUNDS pp pp pp\n0 {box}\n0 {box}\n0 {box}\n'.format(box=box))
+            f.write('ITEM: ATOMS {}\n'.format(' '.join(columns)))
+            values = list()
+            for column in columns:
+                if column == 'id':
+                    values.append(ids)
+                elif column == 'type':
+                    values.append(1 + ids % 3)
+                elif column in ('mol', 'ix', 'iy', 'iz'):
+                    values.append(rng.integers(-2, 3, n_atoms))
+                elif column in ('x', 'y', 'z', 'xu', 'yu', 'zu'):
+                    values.append(rng.random(n_atoms) * box)
+                else:
+                    values.append(rng.normal(size=n_atoms))
+            numpy.savetxt(f, numpy.column_stack(values), fmt=fmt)
+
+
+def write_xyz(path, n_frames, n_atoms, box=20.0, seed=0):
+    rng = numpy.random.default_rng(seed)
+    elements = numpy.array(['O', 'H', 'H'])[numpy.arange(n_atoms) % 3]
+    with open(path, 'w') as f:
+        for frame in range(n_frames):
+            f.write('{}\n i = {}, time = {:.3f}, E = {:.10f}\n'.format(n_atoms, frame, frame * 0.5, rng.normal()))
+            coords = rng.random((n_atoms, 3)) * box
+            lines = ['{} {:.10f} {:.10f} {:.10f}\n'.format(element, *xyz) for element, xyz in zip(elements, coords)]
+            f.write(''.join(lines))
+
+
+thermo_columns = ('Step', 'Temp', 'E_pair', 'E_mol', 'TotEng', 'Press', 'Volume')
+
+
+# Log with n_runs "run" commands of n_steps thermo rows each, with the
+# setup summary, a warning inside every thermo block and the loop timing.
+def write_log(path, n_runs, n_steps, columns=thermo_columns, seed=0):
+    rng = numpy.random.default_rng(seed)
+    fmt = ' '.join(['%10d'] + ['%14.8g'] * (len(columns) - 1))
+    with open(path, 'w') as f:
+        f.write('LAMMPS (29 Oct 2020)\nthermo_style custom {}\n'.format(' '.join(c.lower() for c in columns)))
+        for run in range(n_runs):
+            f.write('Setting up Verlet run ...\n  Unit style    : real\n  Current step  : {}\n  Time step     : 1\n'.format(run * n_steps))
+            f.write('Per MPI rank memory allocation (min/avg/max) = 12.5 | 12.5 | 12.5 Mbytes\n')
+            f.write(' '.join(columns) + '\n')
+            values = numpy.column_stack([numpy.arange(n_steps) + run * n_steps] + [rng.normal(size=n_steps) * 100 for _ in columns[1:]])
+            half = n_steps // 2
+            numpy.savetxt(f, values[:half], fmt=fmt)
+            f.write('WARNING: Step size may be too large (../fix_nh.cpp:123)\n')
+            numpy.savetxt(f, values[half:], fmt=fmt)
+            f.write('Loop time of 12.3 on 4 procs for {} steps with 1000 atoms\n\n'.format(n_steps))
+        f.write('Total wall time: 0:01:00\n')
+
+
+# fix ave/time file, scalar mode or with vector_rows rows per timestep
+def write_ave_time(path, n_steps, n_columns, vector_rows=None, seed=0):
+    rng = numpy.random.default_rng(seed)
+    with open(path, 'w') as f:
+        f.write('# Time-averaged data for fix ave\n')
+        if vector_rows is None:
+            names = ['c_val[{}]'.format(i + 1) for i in range(n_columns)]
+            f.write('# TimeStep {}\n'.format(' '.join(names)))
+            values = numpy.column_stack([numpy.arange(n_steps) * 100] + [rng.normal(size=n_steps) for _ in names])
+            numpy.savetxt(f, values, fmt=['%d'] + ['%.8g'] * n_columns)
+            return
+        f.write('# TimeStep Number-of-rows\n# Row {}\n'.format(' '.join('c_vec[{}]'.format(i + 1) for i in range(n_columns))))
+        rows = numpy.arange(1, vector_rows + 1)
+        for step in range(n_steps):
+            f.write('{} {}\n'.format(step * 100, vector_rows))
+            numpy.savetxt(f, numpy.column_stack([rows] + [rng.normal(size=vector_rows) for _ in range(n_columns)]),
+                          fmt=['%d'] + ['%.8g'] * n_columns)
+
+
+# fix ave/chunk file of 1d bins with Ncount and n_values quantities
+def write_ave_chunk(path, n_steps, n_chunks, n_values=1, seed=0):
+    rng = numpy.random.default_rng(seed)
+    names = ['v{}'.format(i + 1) for i in range(n_values)]
+    with open(path, 'w') as f:
+        f.write('# Chunk-averaged data for fix chunk and group all\n# Timestep Number-of-chunks Total-count\n')
+        f.write('# Chunk Coord1 Ncount {}\n'.format(' '.join(names)))
+        chunks = numpy.arange(1, n_chunks + 1)
+        coords = (chunks - 0.5) * 0.5
+        for step in range(n_steps):
+            counts = rng.poisson(20, n_chunks)
+            f.write('{} {} {}\n'.format(step * 100, n_chunks, counts.sum()))
+            numpy.savetxt(f, numpy.column_stack([chunks, coords, counts] + [rng.random(n_chunks) for _ in names]),
+                          fmt=['%d', '%.4g', '%.8g'] + ['%.8g'] * n_values)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of the readers and analysis kernels.
+
+Every benchmark writes its synthetic input (see benchmarks.generators) for
+each scale of the size sweep and runs in a fresh process, so the peak RSS
+belongs to that benchmark alone. Wall time is the best of --repeat runs,
+throughput is reported as MB/s of input and frames (rows, timesteps) per
+second. Results are printed and saved as JSON; --compare prints the ratio
+to an earlier result file.
+
+    python -m benchmarks.suite [--scales 1 2 4] [--only lammpstrj_stream read_log]
+                               [--repeat 3] [--output results.json] [--compare old.json]
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy
+
+import analysis
+import lammps
+import system
+import trajectory
+from benchmarks import generators
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+#---------------------------------------------------
+# Benchmark runners, executed in the worker process. Every runner gets
+# the input path and returns the number of frames it processed. The
+# modules are imported with this module, outside the timed call.
+#---------------------------------------------------
+
+def run_lammpstrj(path, mode):
+    traj = trajectory.lammpstrj(path, mode=mode)
+    for frame in traj:
+        frame.data()
+    traj.close()
+    return traj.n_frames
+
+
+def run_lammpstrj_index(path, mode):
+    traj = trajectory.lammpstrj(path, mode=mode)
+    traj.close()
+    return traj.n_frames
+
+
+def run_xyz(path, mode):
+    traj = trajectory.xyz_trajectory(path, mode=mode)
+    for frame in traj:
+        frame.positions()
+    traj.close()
+    return traj.n_frames
+
+
+def run_read_log(path):
+    return sum(len(run) for run in lammps.read_log(path).values())
+
+
+def run_read_ave_time(path):
+    return len(lammps.read_ave_time(path))
+
+
+def run_read_ave_time_vector(path):
+    return len(lammps.read_ave_time_vector(path)[0])
+
+
+def run_read_ave_chunk(path):
+    return len(lammps.read_ave_chunk(path))
+
+
+def run_read_ave_chunk_array(path):
+    return len(lammps.read_ave_chunk_array(path)[0])
+
+
+def run_distances(path, chunk_size):
+    traj = trajectory.lammpstrj(path, mode='stream')
+    frame = traj[0]
+    positions = frame.data(columns=['x', 'y', 'z'])
+    frame_system = system.system(positions, numpy.array(frame.cell())[:, :2].tolist())
+    frame_system.self_distances(dtype=numpy.float32, chunk_size=chunk_size)
+    return 1
+
+
+def run_density_profile(path):
+    traj = trajectory.lammpstrj(path, mode='stream')
+    analysis.density_profile(traj, axis=2, bin_width=0.2)
+    return traj.n_frames
+
+
+#---------------------------------------------------
+# Benchmarks: name -> (writer, writer arguments for a scale, runner,
+# runner arguments). Sizes grow linearly with the scale.
+#---------------------------------------------------
+
+benchmarks = {
+    'lammpstrj_index': (generators.write_lammpstrj, lambda s: {'n_frames': 200 * s, 'n_atoms': 1000}, run_lammpstrj_index, {'mode': 'stream'}),
+    'lammpstrj_memory': (generators.write_lammpstrj, lambda s: {'n_frames': 20 * s, 'n_atoms': 10000}, run_lammpstrj, {'mode': 'memory'}),
+    'lammpstrj_stream': (generators.write_lammpstrj, lambda s: {'n_frames': 20 * s, 'n_atoms': 10000}, run_lammpstrj, {'mode': 'stream'}),
+    'lammpstrj_mmap': (generators.write_lammpstrj, lambda s: {'n_frames': 20 * s, 'n_atoms': 10000}, run_lammpstrj, {'mode': 'mmap'}),
+    'xyz_stream': (generators.write_xyz, lambda s: {'n_frames': 20 * s, 'n_atoms': 10000}, run_xyz, {'mode': 'stream'}),
+    'read_log': (generators.write_log, lambda s: {'n_runs': 2, 'n_steps': 100000 * s}, run_read_log, {}),
+    'read_ave_time': (generators.write_ave_time, lambda s: {'n_steps': 100000 * s, 'n_columns': 8}, run_read_ave_time, {}),
+    'read_ave_time_vector': (generators.write_ave_time, lambda s: {'n_steps': 2000 * s, 'n_columns': 2, 'vector_rows': 100},
+                             run_read_ave_time_vector, {}),
+    'read_ave_chunk': (generators.write_ave_chunk, lambda s: {'n_steps': 10000 * s, 'n_chunks': 50}, run_read_ave_chunk, {}),
+    'read_ave_chunk_array': (generators.write_ave_chunk, lambda s: {'n_steps': 10000 * s, 'n_chunks': 50}, run_read_ave_chunk_array, {}),
+    'distances': (generators.write_lammpstrj, lambda s: {'n_frames': 1, 'n_atoms': 2000 * s}, run_distances, {'chunk_size': 1 << 20}),
+    'density_profile': (generators.write_lammpstrj, lambda s: {'n_frames': 20 * s, 'n_atoms': 10000}, run_density_profile, {}),
+}
+
+
+# Peak resident set size of this process in MB (None without resource)
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _measure(runner, path, kwargs):
+    start = time.perf_counter()
+    frames = runner(path, **kwargs)
+    wall = time.perf_counter() - start
+    return wall, frames, peak_rss()
+
+
+def measure(runner, path, kwargs, repeat):
+    context = multiprocessing.get_context('spawn')
+    best = None
+    for _ in range(repeat):
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+            result = executor.submit(_measure, runner, path, kwargs).result()
+        if best is None or result[0] < best[0]:
+            best = result
+    return best
+
+
+def run(names, scales, repeat, directory):
+    results = list()
+    for name in names:
+        writer, sizes, runner, kwargs = benchmarks[name]
+        for scale in scales:
+            path = os.path.join(directory, name)
+            writer(path, **sizes(scale))
+            size = os.path.getsize(path)
+            wall, frames, rss = measure(runner, path, kwargs, repeat)
+            os.remove(path)
+            results.append({'benchmark': name, 'scale': scale, 'sizes': sizes(scale), 'bytes': size,
+                            'wall_s': wall, 'mb_per_s': size / 1024**2 / wall, 'frames': frames,
+                            'frames_per_s': frames / wall, 'peak_rss_mb': rss})
+            print_result(results[-1])
+    return results
+
+
+def metadata():
+    import pandas
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'numpy': numpy.__version__, 'pandas': pandas.__version__}
+
+
+def print_result(result):
+    rss = '-' if result['peak_rss_mb'] is None else '{:.0f}'.format(result['peak_rss_mb'])
+    print('{:<22} {:>5} {:>10.1f} {:>10.3f} {:>10.1f} {:>12.1f} {:>10}'.format(
+        result['benchmark'], result['scale'], result['bytes'] / 1024**2, result['wall_s'],
+        result['mb_per_s'], result['frames_per_s'], rss))
+
+
+# Ratio of the wall times of equal benchmarks and scales (old / new, > 1 is faster)
+def compare(results, old_results):
+    old = {(result['benchmark'], result['scale']): result for result in old_results}
+    print('\n{:<22} {:>5} {:>10} {:>10} {:>8}'.format('benchmark', 'scale', 'old [s]', 'new [s]', 'speedup'))
+    for result in results:
+        key = (result['benchmark'], result['scale'])
+        if key in old:
+            print('{:<22} {:>5} {:>10.3f} {:>10.3f} {:>8.2f}'.format(
+                key[0], key[1], old[key]['wall_s'], result['wall_s'], old[key]['wall_s'] / result['wall_s']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks), default=list(benchmarks))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None)
+    args = parser.parse_args()
+
+    print('{:<22} {:>5} {:>10} {:>10} {:>10} {:>12} {:>10}'.format(
+        'benchmark', 'scale', 'input [MB]', 'wall [s]', 'MB/s', 'frames/s', 'RSS [MB]'))
+    with tempfile.TemporaryDirectory() as directory:
+        results = run(args.only, args.scales, args.repeat, directory)
+    with open(args.output, 'w') as f:
+        json.dump({'metadata': metadata(), 'results': results}, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Johannes Gäding
+"""
+
+import bisect
+import json
+import os
+import threading
+
+import numpy
+
+import trajectory
+
+#---------------------------------------------------
+# Binary, columnar copy of a lammpstrj or xyz_trajectory.
+#
+# convert() parses the text trajectory once and writes every dump column as
+# its own array, frames grouped into chunks of chunk_frames frames.
+# binary_trajectory() reads it back with the API of the text classes, so
+# scripts only change the line opening the trajectory.
+#
+# format='npy' (default, numpy only) writes a directory:
+#
+# <path>/manifest.json          -- columns, dtypes, chunks and source of the trajectory
+# <path>/frames.npz             -- timesteps, atoms_per_frame, boxes, row offsets (and xyz comments)
+# <path>/chunk_00000/<i>.npy    -- column i of the frames of chunk 0 (compression=None, memory-mapped on read)
+# <path>/chunk_00000.npz        -- all columns of the frames of chunk 0 (compression='zlib')
+#
+# format='hdf5' writes a single file with one chunked dataset per column
+# (requires h5py >= 3, text columns are read with asstr()). compression is
+# None (uncompressed), 'zlib' or 'gzip' (both deflate) or 'lzf'.
+#
+# Text columns (element) are stored with the width of their longest entry;
+# a frame whose text column arrives empty is rejected instead of stored.
+#
+# Frames may have different numbers of atoms, rows of all frames of a chunk
+# are stored one after another.
+#---------------------------------------------------
+
+store_version = 1
+
+def convert(traj, path, chunk_frames=100, compression=None, format='npy'):
+    if format not in ('npy', 'hdf5'):
+        raise ValueError('Unknown format "{format}". Choose "npy" or "hdf5".'.format(format=format))
+    if format == 'npy' and compression not in (None, 'zlib'):
+        raise ValueError('Compression of the npy format is either None or "zlib".')
+    if format == 'hdf5' and compression not in (None, 'zlib', 'gzip', 'lzf'):
+        raise ValueError('Compression of the hdf5 format is one of None, "zlib", "gzip" or "lzf".')
+    kind = 'xyz' if hasattr(traj, 'comments') else 'lammpstrj'
+    if format == 'npy':
+        os.makedirs(path, exist_ok=True)
+    n_frames = traj.n_frames
+    atoms_per_frame = numpy.array(traj.atoms_per_frame, dtype=numpy.int64)
+    row_offsets = numpy.hstack(([0], numpy.cumsum(atoms_per_frame)))
+    if kind == 'lammpstrj':
+        timesteps = numpy.array(traj.timesteps, dtype=numpy.int64)
+    else:
+        timesteps = numpy.arange(n_frames, dtype=numpy.int64)
+    columns = None
+    boxes = None
+    chunks = list()
+    writer = _hdf5_writer(path, compression) if format == 'hdf5' else None
+    try:
+        for first in range(0, n_frames, chunk_frames):
+            records = list()
+            for i, frame in enumerate(traj[first:first+chunk_frames], first):
+                record, frame_columns, box = _frame_record(frame, kind)
+                if columns is None:
+                    columns = frame_columns
+                    dtypes = [record.dtype[name].str for name in columns]
+                    if box is not None:
+                        boxes = numpy.full((n_frames, 3, len(box[0])), numpy.nan)
+                elif frame_columns != columns:
+                    raise ValueError('Frame {i} has columns {frame_columns}, expected {columns}.'.format(i=i, frame_columns=frame_columns, columns=columns))
+                if box is not None:
+                    boxes[i] = box
+                records.append(record)
+            arrays = [numpy.concatenate([record[name] for record in records]) for name in columns]
+            # text columns of later chunks may be wider than in the first frame
+            dtypes = [numpy.promote_types(dtype, array.dtype).str for dtype, array in zip(dtypes, arrays)]
+            chunk = {'first_frame': first, 'n_frames': len(records), 'first_row': int(row_offsets[first])}
+            if format == 'hdf5':
+                writer.append(columns, arrays)
+            else:
+                chunk['file'] = _write_npy_chunk(path, len(chunks), arrays, compression)
+            chunks.append(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if columns is None:
+        columns, dtypes = list(), list()
+    manifest = {'format': 'lapy3-binary-trajectory', 'version': store_version, 'kind': kind, 'source': os.path.abspath(traj.path),
+                'storage': format, 'compression': compression, 'n_frames': n_frames,
+                'columns': columns, 'dtypes': dtypes, 'chunks': chunks}
+    frames = {'timesteps': timesteps, 'atoms_per_frame': atoms_per_frame, 'row_offsets': row_offsets}
+    if boxes is not None:
+        frames['boxes'] = boxes
+    if kind == 'xyz':
+        frames['comments'] = numpy.array([' '.join(comment) for comment in traj.comments], dtype=str)
+    if format == 'hdf5':
+        _write_hdf5_frames(path, manifest, frames)
+    else:
+        with open(os.path.join(path, 'frames.npz'), 'wb') as f:
+            numpy.savez(f, **frames)
+        with open(os.path.join(path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=1)
+    return binary_trajectory(path)
+
+# Columns of a text frame as record array with their natural dtypes.
+def _frame_record(frame, kind):
+    if kind == 'xyz':
+        positions = frame.positions()
+        record = numpy.zeros(len(positions), dtype=[('type', frame.atom_types().dtype), ('x', float), ('y', float), ('z', float)])
+        record['type'] = frame.atom_types()
+        record['x'], record['y'], record['z'] = positions[:,0], positions[:,1], positions[:,2]
+        return record, ['type', 'x', 'y', 'z'], None
+    record = frame.data(dtype=frame.dtypes())
+    for name in record.dtype.names:
+        if record.dtype[name].kind in 'SU' and len(record) > 0 and numpy.any(numpy.char.str_len(record[name]) == 0):
+            raise ValueError('Text column "{name}" of frame {i} was read empty.'.format(name=name, i=frame.frame))
+    return record, frame.columns(), frame.cell()
+
+def _write_npy_chunk(path, n, arrays, compression):
+    if compression == 'zlib':
+        name = 'chunk_{n:05d}.npz'.format(n=n)
+        with open(os.path.join(path, name), 'wb') as f:
+            numpy.savez_compressed(f, **{str(i): array for i, array in enumerate(arrays)})
+        return name
+    name = 'chunk_{n:05d}'.format(n=n)
+    os.makedirs(os.path.join(path, name), exist_ok=True)
+    for i, array in enumerate(arrays):
+        numpy.save(os.path.join(path, name, '{i}.npy'.format(i=i)), array)
+    return name
+
+class _hdf5_writer:
+
+    def __init__(self, path, compression):
+        import h5py
+        self.file = h5py.File(path, 'w')
+        self.compression = 'gzip' if compression == 'zlib' else compression
+        self.datasets = None
+
+    def append(self, columns, arrays):
+        if self.datasets is None:
+            group = self.file.create_group('columns')
+            self.datasets = list()
+            for i, array in enumerate(arrays):
+                dtype = array.dtype
+                if dtype.kind == 'U':
+                    import h5py
+                    dtype = h5py.string_dtype()
+                self.datasets.append(group.create_dataset(str(i), shape=(0,), maxshape=(None,), dtype=dtype,
+                                                          chunks=(max(1, min(len(array), 1 << 16)),), compression=self.compression))
+        for dataset, array in zip(self.datasets, arrays):
+            n = len(dataset)
+            dataset.resize((n + len(array),))
+            dataset[n:] = array.astype(object) if array.dtype.kind == 'U' else array
+
+    def close(self):
+        self.file.close()
+
+def _write_hdf5_frames(path, manifest, frames):
+    import h5py
+    with h5py.File(path, 'a') as f:
+        f.attrs['manifest'] = json.dumps(manifest)
+        group = f.require_group('frames')
+        for name, array in frames.items():
+            if array.dtype.kind == 'U':
+                group.create_dataset(name, data=array.astype(object), dtype=h5py.string_dtype())
+            else:
+                group.create_dataset(name, data=array)
+
+#---------------------------------------------------
+# Reader of trajectories written by convert().
+#
+# Class is iterable and subscriptable by the n-frames like lammpstrj and
+# xyz_trajectory and offers the functions of the converted class:
+#
+# <binary_trajectory>.data(), .columns(), .cell(), .df_frame()    -- converted from lammpstrj
+# <binary_trajectory>.positions(), .atom_types()                  -- converted from xyz_trajectory
+#
+# porperties:
+#
+# <binary_trajectory>.frame		        -- frame used by the functions of the trajectory itself - int
+# <binary_trajectory>.n_frames		    -- number of total frames in trajectory - int
+# <binary_trajectory>.atoms_per_frame	-- number of atoms per timestep - list()
+# <binary_trajectory>.timesteps	        -- timestep of the logged frames - list()
+# <binary_trajectory>.comments	        -- split comment line of every frame (xyz only) - list(list(str))
+#---------------------------------------------------
+
+class binary_trajectory:
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isdir(path):
+            with open(os.path.join(path, 'manifest.json')) as f:
+                self.manifest = json.load(f)
+            with numpy.load(os.path.join(path, 'frames.npz')) as stored:
+                frames = {name: stored[name] for name in stored.files}
+        else:
+            import h5py
+            with h5py.File(path, 'r') as f:
+                self.manifest = json.loads(f.attrs['manifest'])
+                frames = dict()
+                for name, dataset in f['frames'].items():
+                    if h5py.check_string_dtype(dataset.dtype) is not None:
+                        frames[name] = dataset.asstr()[()]
+                    else:
+                        frames[name] = dataset[()]
+        if self.manifest.get('format') != 'lapy3-binary-trajectory' or self.manifest.get('version') != store_version:
+            raise ValueError('"{path}" is not a binary trajectory of version {version}.'.format(path=path, version=store_version))
+        self.kind = self.manifest['kind']
+        self.n_frames = self.manifest['n_frames']
+        self.timesteps = frames['timesteps'].tolist()
+        self.atoms_per_frame = frames['atoms_per_frame'].tolist()
+        self.row_offsets = frames['row_offsets']
+        self.boxes = frames.get('boxes')
+        if self.kind == 'xyz':
+            self.comments = [str(comment).split() for comment in frames['comments']]
+        self.frame = 0
+        self._chunk_starts = [chunk['first_frame'] for chunk in self.manifest['chunks']]
+        self._loaded = (None, None)
+        self._h5 = None
+        self._lock = threading.Lock()
+
+    def column_names(self):
+        return list(self.manifest['columns'])
+
+    def close(self):
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
+        self._loaded = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.n_frames
+
+    def __iter__(self):
+        for i in range(self.n_frames):
+            yield self[i]
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            return [self[i] for i in range(*x.indices(self.n_frames))]
+        if numpy.ndim(x) > 0:
+            x = numpy.asarray(x)
+            if x.dtype == bool:
+                x = numpy.flatnonzero(x)
+            return [self[i] for i in x]
+        i = int(x)
+        if i < 0:
+            i += self.n_frames
+        if i < 0 or i >= self.n_frames:
+            raise IndexError('Frame {i} out of range for trajectory with {n} frames.'.format(i=i, n=self.n_frames))
+        if self.kind == 'xyz':
+            return binary_xyz_frame(self, i)
+        return binary_lammpstrj_frame(self, i)
+
+    # Rows of column (by position) of frame i. Memory-mapped .npy chunks and
+    # hdf5 datasets are sliced directly, a compressed chunk is decompressed
+    # once and kept until another chunk is read.
+    def _column(self, column, i):
+        start, stop = int(self.row_offsets[i]), int(self.row_offsets[i+1])
+        if self.manifest['storage'] == 'hdf5':
+            with self._lock:
+                if self._h5 is None:
+                    import h5py
+                    self._h5 = h5py.File(self.path, 'r')
+                dataset = self._h5['columns'][str(column)]
+                if dataset.dtype.kind == 'O':
+                    return numpy.array(dataset.asstr()[start:stop], dtype=str)
+                return dataset[start:stop]
+        n = bisect.bisect_right(self._chunk_starts, i) - 1
+        chunk = self.manifest['chunks'][n]
+        start, stop = start - chunk['first_row'], stop - chunk['first_row']
+        with self._lock:
+            if self._loaded[0] != n:
+                filename = os.path.join(self.path, chunk['file'])
+                if self.manifest['compression'] == 'zlib':
+                    with numpy.load(filename) as stored:
+                        arrays = [stored[str(k)] for k in range(len(self.manifest['columns']))]
+                else:
+                    arrays = [numpy.load(os.path.join(filename, '{k}.npy'.format(k=k)), mmap_mode='r') for k in range(len(self.manifest['columns']))]
+                self._loaded = (n, arrays)
+            return numpy.array(self._loaded[1][column][start:stop])
+
+    map_frames = trajectory._trajectory.map_frames
+
+    def data(self, columns=None, dtype=float):
+        return self[self.frame].data(columns=columns, dtype=dtype)
+
+    def dtypes(self):
+        return self[self.frame].dtypes()
+
+    def cell(self):
+        return self[self.frame].cell()
+
+    def columns(self):
+        return self[self.frame].columns()
+
+    def df_frame(self, columns=None):
+        return self[self.frame].df_frame(columns=columns)
+
+    def positions(self):
+        return self[self.frame].positions()
+
+    def atom_types(self):
+        return self[self.frame].atom_types()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_loaded'] = (None, None)
+        state['_h5'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+class _binary_frame:
+
+    __slots__ = ('trajectory', 'frame')
+
+    def __init__(self, trajectory, frame):
+        self.trajectory = trajectory
+        self.frame = frame
+
+    def __repr__(self):
+        return '<{cls} {frame} of "{path}">'.format(cls=type(self).__name__, frame=self.frame, path=self.trajectory.path)
+
+    @property
+    def timestep(self):
+        return self.trajectory.timesteps[self.frame]
+
+class binary_lammpstrj_frame(_binary_frame):
+
+    __slots__ = ()
+
+    def columns(self):
+        return self.trajectory.column_names()
+
+    def dtypes(self):
+        return {name: numpy.dtype(dtype) for name, dtype in zip(self.trajectory.manifest['columns'], self.trajectory.manifest['dtypes'])}
+
+    def data(self, columns=None, dtype=float):
+        names = self.columns()
+        if columns is None:
+            usecols = list(range(len(names)))
+        else:
+            if isinstance(columns, (str, int)):
+                columns = [columns]
+            usecols = list()
+            for column in columns:
+                if isinstance(column, str):
+                    if column not in names:
+                        raise ValueError('Column "{column}" not found. Available columns: {names}'.format(column=column, names=names))
+                    column = names.index(column)
+                usecols.append(int(column))
+        arrays = [self.trajectory._column(k, self.frame) for k in usecols]
+        if isinstance(dtype, dict):
+            fields = list()
+            for k, array in zip(usecols, arrays):
+                field = numpy.dtype(dtype.get(names[k], float))
+                fields.append((names[k], array.dtype if field.kind == 'U' else field))
+            record = numpy.zeros(self.trajectory.atoms_per_frame[self.frame], dtype=fields)
+            for k, array in zip(usecols, arrays):
+                record[names[k]] = array
+            return record
+        if len(arrays) == 0:
+            return numpy.zeros((self.trajectory.atoms_per_frame[self.frame], 0), dtype=dtype)
+        return numpy.column_stack(arrays).astype(dtype)
+
+    def cell(self):
+        return self.trajectory.boxes[self.frame].tolist()
+
+    def df_frame(self, columns=None):
+        import pandas
+        return pandas.DataFrame(data=self.data(columns=columns, dtype=self.dtypes()))
+
+class binary_xyz_frame(_binary_frame):
+
+    __slots__ = ()
+
+    def positions(self):
+        return numpy.column_stack([self.trajectory._column(k, self.frame) for k in (1, 2, 3)])
+
+    def atom_types(self):
+        return self.trajectory._column(0, self.frame)
+
+    def comment(self):
+        return self.trajectory.comments[self.frame]
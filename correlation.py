@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Johannes Gäding
+"""
+
+import tempfile
+
+import numpy
+
+import system
+
+#---------------------------------------------------
+# Time correlation functions of a lammpstrj (or xyz_trajectory) with FFT.
+#
+# The trajectory is read once and the (unwrapped) coordinates or the
+# velocities of all frames are collected in a (n_frames, n_atoms, 3) array.
+# If it is larger than max_bytes it is kept in a temporary file on disk
+# (numpy.memmap) instead of memory. The correlation is then computed for
+# blocks of block_atoms atoms, every block with one FFT along the time
+# axis, which is O(T log T) instead of O(T^2) per atom.
+#
+# Atoms are ordered by the id column if present, so unsorted dumps work.
+# Frames have to be equally spaced and contain the same atoms.
+#---------------------------------------------------
+
+# Coordinate columns in order of preference and how they are unwrapped
+unwrap_columns = ((('xu', 'yu', 'zu'), 'unwrapped'),
+                  (('xsu', 'ysu', 'zsu'), 'unwrapped'),
+                  (('x', 'y', 'z'), 'images'),
+                  (('xs', 'ys', 'zs'), 'images'))
+image_columns = ('ix', 'iy', 'iz')
+velocity_columns = ('vx', 'vy', 'vz')
+
+#---------------------------------------------------
+# Mean squared displacement <|r(t+m) - r(t)|^2> averaged over time origins
+# t and atoms, for all lags m.
+#
+# Coordinates are unwrapped with the image flags ix iy iz if dumped,
+# else from the displacement between consecutive frames, which is folded
+# into the box of cell() (minimum image). For xyz_trajectory a box enables
+# the latter, without one the coordinates are taken as unwrapped.
+#
+# types       ... None for the average of all atoms or list of types, e.g. [1, 2]
+# frames      ... equally spaced frame indices, all frames if None
+# box         ... box of xyz trajectories [lx, ly, lz] or [[xlo, xhi], [ylo, yhi], [zlo, zhi]]
+# block_atoms ... atoms per FFT block, chosen from max_bytes if None
+# max_bytes   ... memory for the collected coordinates before using a temporary file
+#
+# Returns the lags (in timesteps for lammpstrj, in frames otherwise) and
+# the msd - numpy.array(n_frames) for types=None, else dict {type: numpy.array(n_frames)}.
+#---------------------------------------------------
+
+def msd(traj, types=None, frames=None, box=None, pbc=[1,1,1], type_column='type', block_atoms=None, max_bytes=2**30):
+    values, atom_types, lags = _collect(traj, frames, box, pbc, type_column, 'positions', max_bytes)
+    return lags, _correlate(values, atom_types, types, block_atoms, max_bytes, _msd_block)
+
+#---------------------------------------------------
+# Velocity autocorrelation function <v(t) . v(t+m)> averaged over time
+# origins t and atoms, from the dumped velocities vx vy vz.
+#
+# normalize ... divide by the value at lag 0
+#
+# Arguments and return values as in msd().
+#---------------------------------------------------
+
+def vacf(traj, types=None, frames=None, normalize=False, type_column='type', block_atoms=None, max_bytes=2**30):
+    values, atom_types, lags = _collect(traj, frames, None, None, type_column, 'velocities', max_bytes)
+    result = _correlate(values, atom_types, types, block_atoms, max_bytes, _acf_block)
+    if normalize:
+        if isinstance(result, dict):
+            result = {key: c / c[0] for key, c in result.items()}
+        else:
+            result = result / result[0]
+    return lags, result
+
+#---------------------------------------------------
+# Time autocorrelation of every atom of a (T, B, 3) block summed over the
+# three components: sum_t x(t) x(t+m) / (T - m), with zero padding to 2T
+# so the circular FFT correlation equals the linear one.
+#---------------------------------------------------
+
+def _autocorrelation(x):
+    n = len(x)
+    spectrum = numpy.fft.rfft(x, n=2*n, axis=0)
+    power = (spectrum * spectrum.conj()).real.sum(axis=2)
+    return numpy.fft.irfft(power, n=2*n, axis=0)[:n] / (n - numpy.arange(n))[:,None]
+
+def _acf_block(x):
+    return _autocorrelation(x)
+
+# MSD(m) = S1(m) - 2 S2(m) with S2 the autocorrelation and
+# S1(m) = sum_t (r(t)^2 + r(t+m)^2) / (T - m), from cumulative sums
+def _msd_block(x):
+    n = len(x)
+    d = numpy.sum(x**2, axis=2)
+    removed = numpy.cumsum(d + d[::-1], axis=0)
+    removed = numpy.vstack((numpy.zeros((1, d.shape[1])), removed[:-1]))
+    s1 = (2 * d.sum(axis=0) - removed) / (n - numpy.arange(n))[:,None]
+    return s1 - 2 * _autocorrelation(x)
+
+# Averages the per atom correlations of all blocks by type
+def _correlate(values, atom_types, types, block_atoms, max_bytes, kernel):
+    n_frames, n_atoms = values.shape[:2]
+    if block_atoms is None:
+        # rfft of 2T values per component, complex128
+        block_atoms = max(1, int(max_bytes // (n_frames * 3 * 16 * 2)))
+    keys = ['all'] if types is None else list(types)
+    sums = {key: numpy.zeros(n_frames) for key in keys}
+    counts = {key: 0 for key in keys}
+    for start in range(0, n_atoms, block_atoms):
+        block = numpy.asarray(values[:, start:start+block_atoms], dtype=numpy.float64)
+        result = kernel(block)
+        for key in keys:
+            if key == 'all':
+                sums[key] += result.sum(axis=1)
+                counts[key] += result.shape[1]
+            else:
+                selected = atom_types[start:start+block_atoms] == key
+                sums[key] += result[:, selected].sum(axis=1)
+                counts[key] += int(numpy.sum(selected))
+    averages = {key: sums[key] / counts[key] if counts[key] > 0 else numpy.full(n_frames, numpy.nan) for key in keys}
+    if types is None:
+        return averages['all']
+    return averages
+
+#---------------------------------------------------
+# Reads positions or velocities of the selected frames into one
+# (n_frames, n_atoms, 3) array (memmap above max_bytes) together with
+# the atom types (ordered by id) and the lags of the frames.
+#---------------------------------------------------
+
+def _collect(traj, frames, box, pbc, type_column, kind, max_bytes):
+    if frames is None:
+        frames = range(traj.n_frames)
+    frames = list(frames)
+    if len(frames) == 0:
+        raise ValueError('No frames selected.')
+    values = None
+    atom_types = None
+    previous = None
+    for t, i in enumerate(frames):
+        frame = traj[i]
+        if kind == 'velocities':
+            x, frame_types, box_length = _frame_velocities(frame, type_column)
+        else:
+            x, frame_types, box_length = _frame_positions(frame, box, type_column)
+        if values is None:
+            values = _allocate((len(frames),) + x.shape, max_bytes)
+            atom_types = frame_types
+        elif len(x) != values.shape[1]:
+            raise ValueError('Frame {i} contains {n} atoms, expected {m}.'.format(i=frame.frame, n=len(x), m=values.shape[1]))
+        if box_length is not None:
+            # wrapped coordinates, add the minimum image displacement
+            if previous is not None:
+                x_wrapped = x
+                x = values[t-1] + system.minimum_image(x - previous, box_length, pbc)
+                previous = x_wrapped
+            else:
+                previous = x
+        values[t] = x
+    return values, atom_types, _lags(traj, frames)
+
+def _allocate(shape, max_bytes):
+    if numpy.prod(shape) * 8 <= max_bytes:
+        return numpy.zeros(shape)
+    return numpy.memmap(tempfile.TemporaryFile(), dtype=numpy.float64, mode='w+', shape=shape)
+
+def _lags(traj, frames):
+    steps = numpy.asarray(frames)
+    if hasattr(traj, 'timesteps'):
+        steps = numpy.asarray(traj.timesteps)[steps]
+    spacing = numpy.diff(steps)
+    if len(spacing) > 0 and numpy.any(spacing != spacing[0]):
+        raise ValueError('Correlations need equally spaced frames.')
+    return steps - steps[0]
+
+# Unwrapped positions, types and the box length if the positions still
+# have to be unwrapped from frame to frame (else None).
+def _frame_positions(frame, box, type_column):
+    if hasattr(frame, 'positions'):
+        if box is None:
+            return frame.positions(), frame.atom_types(), None
+        return frame.positions(), frame.atom_types(), system.system(frame.positions(), box).box_length
+    names = frame.columns()
+    for xyz, method in unwrap_columns:
+        if all(name in names for name in xyz):
+            break
+    else:
+        raise ValueError('No coordinate columns found in {names}.'.format(names=names))
+    images = method == 'images' and all(name in names for name in image_columns)
+    columns = list(xyz) + (list(image_columns) if images else [])
+    record, frame_types = _frame_record(frame, columns, type_column)
+    cell = numpy.array(frame.cell())[:,:2]
+    length = cell[:,1] - cell[:,0]
+    positions = numpy.column_stack([record[name] for name in xyz]).astype(float)
+    if xyz[0].startswith('xs'):
+        positions = cell[:,0] + positions * length
+    if images:
+        positions += numpy.column_stack([record[name] for name in image_columns]) * length
+    if method == 'images' and not images:
+        return positions, frame_types, length
+    return positions, frame_types, None
+
+def _frame_velocities(frame, type_column):
+    if hasattr(frame, 'positions'):
+        raise ValueError('xyz trajectories contain no velocities.')
+    names = frame.columns()
+    if not all(name in names for name in velocity_columns):
+        raise ValueError('No velocity columns found in {names}.'.format(names=names))
+    record, frame_types = _frame_record(frame, list(velocity_columns), type_column)
+    return numpy.column_stack([record[name] for name in velocity_columns]).astype(float), frame_types, None
+
+# Record array of the columns (plus id and type) sorted by atom id
+def _frame_record(frame, columns, type_column):
+    names = frame.columns()
+    selected = list(columns)
+    for name in ('id', type_column):
+        if name in names and name not in selected:
+            selected.append(name)
+    record = frame.data(columns=selected, dtype=frame.dtypes())
+    if 'id' in names:
+        record = record[numpy.argsort(record['id'], kind='stable')]
+    frame_types = record[type_column] if type_column in names else None
+    return record, frame_types
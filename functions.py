@@ -14,9 +14,10 @@ def smooth(x, lookahead=21, window='flat', pol_order=2):
 
     Parameter
     __________
-    y           ... Eingabevektor
+    x           ... Eingabevektor, 2D-Arrays und DataFrames werden spaltenweise geglaettet
     lookahead   ... Bereich [lookahead/2 ... Zahl ... l/2] aus dem der Mittelwerte gebildet wird
-    window      ... Auswahl der Window-Function (flat, Savgol, hamming, bartlett, blackman, hanning, kaiser,...)
+    window      ... Auswahl der Window-Function (flat, SavGol, hamming, hanning, bartlett, blackman,
+                    ('kaiser', beta), weitere Namen ueber scipy.signal.get_window)
     pol_order   ... Polynomgrad der Aproximationsfunktion für den SavGol filter
     """
 
@@ -26,26 +27,69 @@ def smooth(x, lookahead=21, window='flat', pol_order=2):
 
     aa = int(lookahead // 2)
 
+    values = numpy.asarray(x, dtype=float)
+    if len(values) < lookahead:
+        raise ValueError('lookahead {l} is longer than the input ({n} values).'.format(l=lookahead, n=len(values)))
+    columns = values.reshape(len(values), -1)
+
     # Faltung des Vektors fuer Mittelwerte am Vektorrand
-    s = numpy.r_[x[lookahead - 1:0:-1], x, x[-2:-lookahead - 1:-1]]
+    s = numpy.concatenate((columns[lookahead - 1:0:-1], columns, columns[-2:-lookahead - 1:-1]))
 
     # Auswahl des Mittelwertalgorythmus
-    if window == 'SavGol':
-        y = savgol_filter(x, lookahead, pol_order)
+    if window == 'flat':  # moving average, laufende Summe in O(N)
+        c = numpy.cumsum(numpy.concatenate((numpy.zeros((1, s.shape[1])), s)), axis=0)
+        y = (c[lookahead:] - c[:-lookahead]) / lookahead
     else:
-        if window == 'flat':  # moving average
-            w = numpy.ones(lookahead, 'd')
-        else:
-            w = eval('ws.' + window + '(lookahead)')
-
-        # Bildung Mittelwerte
-        y = numpy.convolve(w / w.sum(), s, mode='valid')
+        w = smoothing_window(window, lookahead, pol_order)
+        y = _convolve_valid(s, w / w.sum())
 
-        # Beschneiden des Vektors
-        y = y[aa:-aa]
+    # Beschneiden des Vektors
+    y = y[aa:len(y) - aa].reshape(values.shape)
 
+    if hasattr(x, 'columns'):
+        return type(x)(y, index=x.index, columns=x.columns)
+    if hasattr(x, 'index'):
+        return type(x)(y, index=x.index, name=x.name)
     return y
- 
+
+# Windows available without scipy, by name
+numpy_windows = {'hamming': numpy.hamming, 'hanning': numpy.hanning, 'hann': numpy.hanning,
+                 'bartlett': numpy.bartlett, 'blackman': numpy.blackman}
+
+# Above this window length the convolution is done by FFT
+fft_window_size = 64
+
+# Weights of a smoothing window of length lookahead. SavGol gives the
+# least squares coefficients of a polynomial of pol_order. Names that
+# numpy does not provide are looked up with scipy.signal.get_window.
+def smoothing_window(window, lookahead, pol_order=2):
+    if window == 'flat':
+        return numpy.ones(lookahead)
+    if window in ('SavGol', 'savgol'):
+        aa = lookahead // 2
+        A = numpy.vander(numpy.arange(-aa, aa + 1, dtype=float), pol_order + 1, increasing=True)
+        return numpy.linalg.pinv(A)[0]
+    if isinstance(window, tuple) and window[0] == 'kaiser':
+        return numpy.kaiser(lookahead, window[1])
+    if window in numpy_windows:
+        return numpy_windows[window](lookahead)
+    try:
+        import scipy.signal
+    except ImportError:
+        raise ValueError('Unknown window "{window}". Without scipy choose one of flat, SavGol, (\'kaiser\', beta), {names}.'.format(
+            window=window, names=', '.join(numpy_windows))) from None
+    return scipy.signal.get_window(window, lookahead, fftbins=False)
+
+# 'valid' convolution of every column of s with the window w. The
+# windows are symmetric, so this is a correlation as well.
+def _convolve_valid(s, w):
+    n = len(s) - len(w) + 1
+    if len(w) <= fft_window_size:
+        return numpy.lib.stride_tricks.sliding_window_view(s, len(w), axis=0) @ w[::-1]
+    size = len(s) + len(w) - 1
+    spectrum = numpy.fft.rfft(s, n=size, axis=0) * numpy.fft.rfft(w, n=size)[:,None]
+    return numpy.fft.irfft(spectrum, n=size, axis=0)[len(w) - 1:len(w) - 1 + n]
+
 def chunkIt(seq, num):
     avg = len(seq) / float(num)
     out = []
@@ -58,41 +102,155 @@ def chunkIt(seq, num):
     return out
 
 
-def reduce_memory_usage(df, verbose=True):
-    numerics = ["int8", "int16", "int32", "int64", "float16", "float32", "float64"]
-    start_mem = df.memory_usage().sum() / 1024
-    for col in df.columns:
-        col_type = df[col].dtypes
-        if col_type in numerics:
-            c_min = df[col].min()
-            c_max = df[col].max()
-            if str(col_type)[:3] == "int":
-                if c_min > np.iinfo(np.int8).min and c_max < np.iinfo(np.int8).max:
-                    df[col] = df[col].astype(np.int8)
-                elif c_min > np.iinfo(np.int16).min and c_max < np.iinfo(np.int16).max:
-                    df[col] = df[col].astype(np.int16)
-                elif c_min > np.iinfo(np.int32).min and c_max < np.iinfo(np.int32).max:
-                    df[col] = df[col].astype(np.int32)
-                elif c_min > np.iinfo(np.int64).min and c_max < np.iinfo(np.int64).max:
-                    df[col] = df[col].astype(np.int64)
-            else:
-                if (
-                    c_min > np.finfo(np.float16).min
-                    and c_max < np.finfo(np.float16).max
-                ):
-                    df[col] = df[col].astype(np.float16)
-                elif (
-                    c_min > np.finfo(np.float32).min
-                    and c_max < np.finfo(np.float32).max
-                ):
-                    df[col] = df[col].astype(np.float32)
-                else:
-                    df[col] = df[col].astype(np.float64)
-    end_mem = df.memory_usage().sum() / 1024
+#---------------------------------------------------
+# Downcasts numeric columns to the smallest dtype holding their values.
+#
+# data          ... pandas DataFrame (columns are replaced in place),
+#                   record array e.g. from lammpstrj.data(dtype=dict) or
+#                   plain ndarray e.g. from lammpstrj.data(); a 2D array is
+#                   returned as record array with one field per column
+# names         ... field names for a plain 2D ndarray, e.g. traj.columns(),
+#                   default f0, f1, ...
+# float_dtype   ... smallest float dtype to use, float16 only if asked for
+# max_rel_error ... largest relative rounding error allowed per float
+#                   value, None checks the value range only
+# integer_columns . names of float columns that become integers if all of
+#                   their values are integral, default lammpstrj.integer_columns
+#                   (id, type, mol, image flags, ...), () keeps all floats
+#
+# Integers become int8/16/32/64 by range. Float columns stay floats,
+# except the integer_columns, and a float column holding only integral
+# values only gets a float dtype representing all of them exactly (ids
+# above 2**24 stay float64). Minimum and maximum of all columns of a dtype
+# are computed in one pass over a 2D block.
+#---------------------------------------------------
+
+def reduce_memory_usage(data, verbose=True, float_dtype=numpy.float32, max_rel_error=None, names=None, integer_columns=None):
+    if integer_columns is None:
+        import trajectory
+        integer_columns = trajectory.lammpstrj.integer_columns
+    if hasattr(data, 'columns'):
+        start_mem = data.memory_usage().sum() / 1024**2
+        for dtype in set(data.dtypes):
+            if dtype.kind not in 'iuf':
+                continue
+            names = [name for name in data.columns if data[name].dtype == dtype]
+            plan = _column_dtypes(data[names].to_numpy(), float_dtype, max_rel_error, [name in integer_columns for name in names])
+            for name, new_dtype in zip(names, plan):
+                if new_dtype != dtype:
+                    data[name] = data[name].astype(new_dtype)
+        end_mem = data.memory_usage().sum() / 1024**2
+    elif data.dtype.names is not None:
+        start_mem = data.nbytes / 1024**2
+        new_dtypes = {name: data.dtype[name] for name in data.dtype.names}
+        for dtype in set(new_dtypes.values()):
+            if dtype.kind not in 'iuf':
+                continue
+            names = [name for name in data.dtype.names if data.dtype[name] == dtype]
+            plan = _column_dtypes(numpy.column_stack([data[name] for name in names]), float_dtype, max_rel_error,
+                                  [name in integer_columns for name in names])
+            new_dtypes.update(zip(names, plan))
+        reduced = numpy.empty(data.shape, dtype=[(name, new_dtypes[name]) for name in data.dtype.names])
+        for name in data.dtype.names:
+            reduced[name] = data[name]
+        data = reduced.view(type(data))
+        end_mem = data.nbytes / 1024**2
+    elif data.ndim == 2:
+        start_mem = data.nbytes / 1024**2
+        if names is None:
+            names = ['f{i}'.format(i=i) for i in range(data.shape[1])]
+        if data.dtype.kind in 'iuf':
+            plan = _column_dtypes(data, float_dtype, max_rel_error, [name in integer_columns for name in names])
+        else:
+            plan = [data.dtype] * data.shape[1]
+        reduced = numpy.empty(len(data), dtype=list(zip(names, plan)))
+        for i, name in enumerate(names):
+            reduced[name] = data[:, i]
+        data = reduced
+        end_mem = data.nbytes / 1024**2
+    else:
+        start_mem = data.nbytes / 1024**2
+        if data.dtype.kind in 'iuf':
+            data = data.astype(_column_dtypes(data.reshape(len(data), 1), float_dtype, max_rel_error)[0])
+        end_mem = data.nbytes / 1024**2
     if verbose:
         print(
             "Mem. usage decreased to {:.2f} Mb ({:.1f}% reduction)".format(
-                end_mem, 100 * (start_mem - end_mem) / start_mem
+                end_mem, 100 * (start_mem - end_mem) / start_mem if start_mem > 0 else 0
             )
         )
-    return df
+    return data
+
+#---------------------------------------------------
+# Compact dtypes for loading a lammpstrj frame directly, e.g.
+# traj.data(dtype=compact_dtypes(traj.dtypes())) parses id/type/image
+# columns as int32 and all other numbers as float32, without a float64
+# array in between. String columns are kept.
+#---------------------------------------------------
+
+def compact_dtypes(dtypes, int_dtype=numpy.int32, float_dtype=numpy.float32):
+    compact = dict()
+    for name, dtype in dtypes.items():
+        if dtype is str:
+            compact[name] = dtype
+        elif numpy.dtype(dtype).kind in 'iu':
+            compact[name] = int_dtype
+        else:
+            compact[name] = float_dtype
+    return compact
+
+# Smallest dtype per column of a 2D block of one numeric dtype. Float
+# columns flagged in to_integer may become integers.
+def _column_dtypes(values, float_dtype, max_rel_error, to_integer=None):
+    n_columns = values.shape[1]
+    if len(values) == 0:
+        return [values.dtype] * n_columns
+    if values.dtype.kind in 'iu':
+        c_min, c_max = values.min(axis=0), values.max(axis=0)
+        plan = list()
+        for low, high in zip(c_min, c_max):
+            for dtype in (numpy.int8, numpy.int16, numpy.int32, numpy.int64):
+                if low >= numpy.iinfo(dtype).min and high <= numpy.iinfo(dtype).max:
+                    plan.append(numpy.dtype(dtype))
+                    break
+            else:
+                plan.append(values.dtype)
+        return plan
+    finite = numpy.isfinite(values)
+    zeroed = numpy.where(finite, values, 0)
+    integral = numpy.all(zeroed == numpy.round(zeroed), axis=0)
+    complete = finite.all(axis=0)
+    peak = numpy.abs(zeroed).max(axis=0)
+    plan = [values.dtype] * n_columns
+    # integral integer columns without NaN / inf are stored as integers,
+    # the float bounds are exact powers of two so no value can overflow
+    c_min, c_max = zeroed.min(axis=0), zeroed.max(axis=0)
+    convert = integral & complete & (c_min >= -2.0**63) & (c_max < 2.0**63)
+    if to_integer is None:
+        convert[:] = False
+    else:
+        convert &= numpy.asarray(to_integer, dtype=bool)
+    for column in numpy.flatnonzero(convert):
+        for dtype in (numpy.int8, numpy.int16, numpy.int32, numpy.int64):
+            bound = 2.0**(numpy.iinfo(dtype).bits - 1)
+            if c_min[column] >= -bound and c_max[column] < bound:
+                plan[column] = numpy.dtype(dtype)
+                break
+    open_columns = numpy.flatnonzero(~convert)
+    for dtype in (numpy.float16, numpy.float32):
+        dtype = numpy.dtype(dtype)
+        if dtype.itemsize < numpy.dtype(float_dtype).itemsize or dtype.itemsize >= values.dtype.itemsize:
+            continue
+        fits = peak[open_columns] <= numpy.finfo(dtype).max
+        # integral values have to stay exact, e.g. ids above 2**24 in float32
+        fits &= ~integral[open_columns] | (peak[open_columns] <= 2.0**(numpy.finfo(dtype).nmant + 1))
+        if max_rel_error is not None:
+            block = values[:, open_columns]
+            with numpy.errstate(invalid='ignore', divide='ignore', over='ignore'):
+                error = numpy.abs(block.astype(dtype).astype(values.dtype) - block) / numpy.abs(block)
+                error = numpy.where(numpy.isfinite(error), error, 0).max(axis=0)
+            fits &= error <= max_rel_error
+        for column in open_columns[fits]:
+            plan[column] = dtype
+        open_columns = open_columns[~fits]
+    return plan
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Johannes Gäding
+"""
+
+import contextlib
+import logging
+import time
+
+#---------------------------------------------------
+# Opt-in instrumentation of the readers.
+#
+# Every reader call (opening or refreshing a trajectory, parsing a frame,
+# read_log, read_ave_time, read_ave_chunk, ...) produces a record
+#
+#   {'reader': 'lammpstrj.frame', 'path': ..., 'bytes_read': int,
+#    'frames_parsed': int, 'index_time': float, 'parse_time': float,
+#    'wall_time': float}
+#
+# (times in seconds). Records are only built while instrumentation is
+# enabled, i.e. a callback is registered or the "lapy3" logger is enabled
+# for DEBUG, where every record is logged with the dict as extra "lapy3".
+# Progress messages of the readers are logged to "lapy3" at INFO level.
+#
+# instrumentation.add_callback(func)        -- func(record) is called for every reader call
+# instrumentation.remove_callback(func)
+# with instrumentation.collect() as records -- list of all records within the block
+#---------------------------------------------------
+
+logger = logging.getLogger('lapy3')
+
+callbacks = list()
+
+def add_callback(func):
+    callbacks.append(func)
+
+def remove_callback(func):
+    callbacks.remove(func)
+
+def enabled():
+    return len(callbacks) > 0 or logger.isEnabledFor(logging.DEBUG)
+
+def emit(record):
+    for func in list(callbacks):
+        func(record)
+    logger.debug('%(reader)s "%(path)s": %(bytes_read)d bytes, %(frames_parsed)d frames, '
+                 'index %(index_time).4f s, parse %(parse_time).4f s, wall %(wall_time).4f s',
+                 record, extra={'lapy3': record})
+
+@contextlib.contextmanager
+def collect():
+    records = list()
+    add_callback(records.append)
+    try:
+        yield records
+    finally:
+        remove_callback(records.append)
+
+#---------------------------------------------------
+# Measurement of one reader call, used as context manager. Counters are
+# set by the reader, phase('index') / phase('parse') add the time spent
+# in a block. The record is emitted on a successful exit.
+#---------------------------------------------------
+
+class reader_call:
+
+    def __init__(self, reader, path):
+        self.reader = reader
+        self.path = path
+        self.bytes_read = 0
+        self.frames_parsed = 0
+        self.index_time = 0.0
+        self.parse_time = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None and enabled():
+            emit(self.record(time.perf_counter() - self.start))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, name + '_time', getattr(self, name + '_time') + time.perf_counter() - start)
+
+    def record(self, wall_time):
+        return {'reader': self.reader, 'path': str(self.path), 'bytes_read': self.bytes_read,
+                'frames_parsed': self.frames_parsed, 'index_time': self.index_time,
+                'parse_time': self.parse_time, 'wall_time': wall_time}
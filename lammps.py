@@ -6,9 +6,15 @@ Created on Tue Apr 28 14:46:57 2020
 @author: Johannes Gäding
 """
 
+import io
+import os
+import re
+import time
+
 import numpy
 import pandas
-import scipy
+
+import instrumentation
 
 #---------------------------------------------------
 # Function to read lammps.log files.
@@ -16,125 +22,510 @@ import scipy
 # number of "run" commands in the lammps-input script.
 # To avoid problems with multiple timesteps by 
 # using reset_timestep for example.
+# columns -- optional subset of thermo keywords to keep
+#---------------------------------------------------
+
+def read_log(log_filename, columns=None, chunk_size=None):
+    runs = _log_runs()
+    for event in _log_events(log_filename, columns, chunk_size, reader='read_log'):
+        runs.add(event)
+    return runs.frames()
+
+#---------------------------------------------------
+# Streaming version of read_log. Yields (run, DataFrame)
+# tuples holding consecutive thermo rows of one run, one
+# per chunk read from disk, so memory stays bounded by
+# chunk_size regardless of the length of the log.
+# A run usually arrives as several blocks.
+#
+# follow -- keep polling the file for new output
+#           (live monitoring) until LAMMPS prints
+#           "Total wall time" or the generator is closed
+#---------------------------------------------------
+
+def iter_log(log_filename, columns=None, chunk_size=None, follow=False,
+             poll_interval=1.0):
+    for event in _log_events(log_filename, columns, chunk_size, follow,
+                             poll_interval, reader='iter_log'):
+        if event[0] == 'rows':
+            yield event[1], event[2]
+
+#---------------------------------------------------
+# Follows a log that is still being written. The log
+# is read up to its current end on construction, every
+# refresh() then parses only the bytes appended since
+# (complete lines only) and returns the new (run,
+# DataFrame) blocks.
+#
+# <log_tail>.read_log()  -- all runs read so far, as returned by read_log - dict
+# <log_tail>.tail()      -- yields new blocks as they are written (async: atail())
+# <log_tail>.offset      -- bytes of the log consumed so far - int
+# <log_tail>.finished    -- LAMMPS printed "Total wall time" - bool
+#---------------------------------------------------
+
+class log_tail:
+
+    def __init__(self, log_filename, columns=None, chunk_size=None):
+        self.path = log_filename
+        self.columns = columns
+        self.chunk_size = log_chunk_size if chunk_size is None else chunk_size
+        self.__reset()
+        self.refresh()
+
+    def __reset(self):
+        self.offset = 0
+        self._parser = _log_parser(self.columns)
+        self._runs = _log_runs()
+
+    @property
+    def finished(self):
+        return self._parser.finished
+
+    # A log that shrank was rewritten (new simulation) and is read again
+    def refresh(self):
+        blocks = list()
+        with open(self.path, 'rb') as f, instrumentation.reader_call('log_tail.refresh', self.path) as call:
+            if os.fstat(f.fileno()).st_size < self.offset:
+                self.__reset()
+            f.seek(self.offset)
+            start = (self._parser.bytes_read, self._parser.rows_parsed, self._parser.parse_time)
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+                self._parser.bytes_read += len(chunk)
+                for event in self._parser.feed(chunk):
+                    self._runs.add(event)
+                    if event[0] == 'rows':
+                        blocks.append((event[1], event[2]))
+            self._parser.report(call, *start)
+        return blocks
+
+    def read_log(self):
+        return self._runs.frames()
+
+    # Yields the new blocks of every refresh() until LAMMPS finished the
+    # log or nothing was written for timeout seconds (None: never).
+    def tail(self, poll_interval=1.0, timeout=None):
+        last_new = time.monotonic()
+        while not self.finished:
+            blocks = self.refresh()
+            if blocks:
+                yield from blocks
+                last_new = time.monotonic()
+            elif timeout is not None and time.monotonic() - last_new >= timeout:
+                return
+            else:
+                time.sleep(poll_interval)
+
+    # Asynchronous version of tail(), refresh() runs in a worker thread
+    async def atail(self, poll_interval=1.0, timeout=None):
+        import asyncio
+        last_new = time.monotonic()
+        while not self.finished:
+            blocks = await asyncio.to_thread(self.refresh)
+            if blocks:
+                for block in blocks:
+                    yield block
+                last_new = time.monotonic()
+            elif timeout is not None and time.monotonic() - last_new >= timeout:
+                return
+            else:
+                await asyncio.sleep(poll_interval)
+
+# Collects the events of a _log_parser into one DataFrame per run
+class _log_runs:
+
+    def __init__(self):
+        self.headers = dict()
+        self.blocks = dict()
+
+    def add(self, event):
+        if event[0] == 'header':
+            self.headers[event[1]] = event[2]
+            self.blocks[event[1]] = list()
+        else:
+            self.blocks[event[1]].append(event[2])
+
+    def frames(self):
+        df_log_dict = {}
+        for run, names in self.headers.items():
+            if self.blocks[run]:
+                df_log_dict[run] = pandas.concat(self.blocks[run], ignore_index=True)
+            else:
+                df_log_dict[run] = pandas.DataFrame(columns=names)
+        return df_log_dict
+
+# Default number of bytes read per step by the log readers
+log_chunk_size = 1 << 24
+
+# Thermo keywords that are parsed as integers
+log_integer_columns = ('Step', 'Elapsed', 'Elaplong', 'Atoms')
+
+# A thermo header is a line of keywords (letter first, no colon)
+# containing the token "Step"; this rejects "WARNING: ... Step"
+# lines, echoed "# Step ..." comments and the "Time step : 1.0"
+# lines of the run setup summary.
+_log_header = re.compile(
+    rb'^[ \t]*(?:[A-Za-z][^\s:]*[ \t]+)*Step(?:[ \t]+[A-Za-z][^\s:]*)*[ \t]*\r?$',
+    re.M)
+_log_numeric_chars = b'0123456789+-.eE \t\r\n'
+_log_numeric = re.compile(rb'^[ \t]*[-+.\d][^\n]*\n', re.M)
+
+# Opens the log and feeds it chunk by chunk into a _log_parser
+def _log_events(log_filename, columns=None, chunk_size=None, follow=False,
+                poll_interval=1.0, reader='read_log'):
+    if chunk_size is None:
+        chunk_size = log_chunk_size
+    parser = _log_parser(columns)
+    with open(log_filename, 'rb') as f, instrumentation.reader_call(reader, log_filename) as call:
+        while True:
+            chunk = f.read(chunk_size)
+            if chunk:
+                parser.bytes_read += len(chunk)
+                yield from parser.feed(chunk)
+            elif follow and not parser.finished:
+                time.sleep(poll_interval)
+            else:
+                yield from parser.feed(b'', final=True)
+                parser.report(call)
+                return
+
+#---------------------------------------------------
+# Incremental thermo parser. feed() takes raw bytes of
+# the log in file order and yields events:
+#   ('header', run, names)    a new thermo block starts,
+#                             names are the kept columns
+#   ('rows', run, DataFrame)  parsed rows of that block
+# Only complete lines are consumed; a trailing partial
+# line is kept until the next feed (or final=True).
+# Block boundaries are located with bytes.find/regex and
+# the rows between them are parsed in bulk by read_csv.
 #---------------------------------------------------
 
-def read_log(log_filename):
-    log_file = open(log_filename, 'r')
-    lines = log_file.readlines()
-    count = 0
-    add = 0
-
-    run_log_dict = {}
-    run = 0
-
-    for line in lines:
-        txt_line = line.strip()
-        if 'Step' in txt_line:
-            run_log_dict[run] = list()
-            add = 1
-            parameters_i = txt_line.split()
-            run_log_dict[run].append(txt_line.split())
-        if 'Loop' in txt_line:
-            add = 0
-            run = run + 1
-        if add == 1:
-            if txt_line.split()[0].isnumeric():
-                run_log_dict[run].append(txt_line.split())
-
-    df_log_dict = {}
-    for i in list(run_log_dict.keys()):
-        log_i = run_log_dict[i]
-        names_i = run_log_dict[i][0]
-        data_i = run_log_dict[i][1:]
-        df = pandas.DataFrame(data_i, columns=names_i)
-        df = df.apply(pandas.to_numeric, errors='coerce')
-        df_log_dict[i] = df
-        
-    return df_log_dict
+class _log_parser:
+
+    def __init__(self, columns=None):
+        self.columns = None if columns is None else list(columns)
+        self.run = -1
+        self.names = None
+        self.usecols = None
+        self.finished = False
+        self._buffer = b''
+        self.bytes_read = 0
+        self.rows_parsed = 0
+        self.parse_time = 0.0
+
+    def feed(self, data, final=False):
+        buf = self._buffer + data
+        if final and buf and not buf.endswith(b'\n'):
+            buf += b'\n'
+        end = buf.rfind(b'\n') + 1
+        pos = 0
+        while pos < end:
+            if self.names is None:
+                m = _find_log_header(buf, pos, end)
+                if m is None:
+                    break
+                self.run += 1
+                self.names = [name.decode() for name in m.group().split()]
+                if self.columns is None:
+                    self.usecols = None
+                    yield 'header', self.run, self.names
+                else:
+                    self.usecols = [c for c in self.columns if c in self.names]
+                    yield 'header', self.run, self.usecols
+                pos = m.end()
+            else:
+                loop = _find_log_end(buf, pos, end)
+                stop = end if loop < 0 else loop
+                m_head = _find_log_header(buf, pos, stop)
+                if m_head is not None:
+                    stop = m_head.start()
+                block = self.__parse_rows(buf[pos:stop])
+                if block is not None:
+                    yield 'rows', self.run, block
+                if m_head is not None:
+                    self.names = None
+                    pos = stop
+                elif loop >= 0:
+                    self.names = None
+                    pos = buf.find(b'\n', loop, end) + 1
+                else:
+                    pos = end
+        if buf.find(b'Total wall time') >= 0:
+            self.finished = True
+        self._buffer = buf[end:]
+
+    # Rows are parsed in one read_csv call; interleaved
+    # non-numeric lines (warnings) are dropped first.
+    # Counters are int64 and everything else float64, so
+    # blocks of the same run always share their dtypes.
+    def __parse_rows(self, rows):
+        if rows.translate(None, _log_numeric_chars):
+            rows = b''.join(_log_numeric.findall(rows))
+        if not rows.strip():
+            return None
+        dtype = {name: 'int64' if name in log_integer_columns else 'float64'
+                 for name in self.names}
+        start = time.perf_counter()
+        block = pandas.read_csv(io.BytesIO(rows), sep=r'\s+', header=None,
+                                names=self.names, usecols=self.usecols,
+                                dtype=dtype, on_bad_lines='skip')
+        self.parse_time += time.perf_counter() - start
+        self.rows_parsed += len(block)
+        return block
 
+    # Fills an instrumentation.reader_call with the counters
+    # since the given start values. Everything but read_csv
+    # counts as index time (reading, locating the blocks).
+    def report(self, call, bytes_read=0, rows_parsed=0, parse_time=0.0):
+        call.bytes_read = self.bytes_read - bytes_read
+        call.frames_parsed = self.rows_parsed - rows_parsed
+        call.parse_time = self.parse_time - parse_time
+        call.index_time = time.perf_counter() - call.start - call.parse_time
+
+# Returns the offset of the next "Loop time of" line
+# between pos and end, or -1
+def _find_log_end(buf, pos, end):
+    if buf.startswith(b'Loop time of', pos, end):
+        return pos
+    i = buf.find(b'\nLoop time of', pos, end)
+    return i if i < 0 else i + 1
+
+# Searches for a thermo header between pos and end, using a
+# plain find for "Step" before running the line regex
+def _find_log_header(buf, pos, end):
+    while True:
+        i = buf.find(b'Step', pos, end)
+        if i < 0:
+            return None
+        line_start = buf.rfind(b'\n', 0, i) + 1
+        m = _log_header.match(buf, line_start, end)
+        if m is not None:
+            return m
+        pos = i + 4
+
+#---------------------------------------------------
 # Reads data from LAMMPS of fix ave/time file
-def read_ave_time(filename):
-
-    print('Reading file {}'.format(filename))
-    df_data = pandas.read_csv(filename)
-    df_data.set_axis(['i'], axis = 1, inplace = True)
-    df_data = df_data.i.str.split(expand=True)
-    header = list(df_data.iloc[0,1:].values)
-    header.append('del')
-    df_data.set_axis(header, axis = 1, inplace = True)
-    df_data = df_data.iloc[1:]
-    df_data.reset_index(drop=True, inplace=True)
-
-    df_data = df_data.drop(['del'], axis=1)
-    df_data = df_data.apply(pandas.to_numeric)
-    print('File processed: {}'.format(filename))
+# Column names are taken from the last "#" header line
+# and the numeric rows are parsed in one read_csv call.
+# columns -- optional subset of columns (the TimeStep
+#            column is read as int64)
+# dtype   -- dtype of the data columns (e.g. numpy.float32)
+# Files written with "mode vector" raise a ValueError,
+# they are read with read_ave_time_vector.
+#---------------------------------------------------
+
+def read_ave_time(filename, columns=None, dtype=numpy.float64):
+
+    instrumentation.logger.info('Reading file %s', filename)
+    comments = _read_comments(filename)
+    if _is_vector_file(comments):
+        raise ValueError('{} was written by fix ave/time with mode vector, '
+                         'read it with read_ave_time_vector.'.format(filename))
+    names = comments[-1].split()[1:]
+    dtypes = {name: numpy.int64 if i == 0 else dtype for i, name in enumerate(names)}
+    with instrumentation.reader_call('read_ave_time', filename) as call:
+        with call.phase('parse'):
+            df_data = pandas.read_csv(filename, sep=r'\s+', header=None, comment='#',
+                                      names=names, usecols=columns, dtype=dtypes)
+        call.bytes_read = os.path.getsize(filename)
+        call.frames_parsed = len(df_data)
+    instrumentation.logger.info('File processed: %s', filename)
 
     return df_data
 
+#---------------------------------------------------
+# Reads a fix ave/time file written with "mode vector":
+# every timestep line (TimeStep Number-of-rows) is
+# followed by one row per vector element.
+# Returns timesteps, a (n_timesteps, n_rows, n_columns)
+# masked array and the column names, as
+# read_ave_chunk_array does for chunk files.
+#---------------------------------------------------
+
+def read_ave_time_vector(filename, columns=None, dtype=numpy.float64):
+    with instrumentation.reader_call('read_ave_time_vector', filename) as call:
+        names, timesteps, counts, rows = _read_block_rows(filename, call)
+    return (timesteps,) + _block_array(names, counts, rows, columns, dtype, filename)
+
 # Reads data from lammps chunk density files
 # returns two dataframes: 
-# first: whole data
+# first: whole data (chunk rows of all frames)
 # second: averaged data by all frames
 def chunk_dens(filename):
-    
-    df_data = pandas.read_csv(filename)
-    df_data.set_axis(['chunk'], axis = 1, inplace = True)
-    df_data = df_data.chunk.str.split(expand=True)
-    df_data = df_data.iloc[2:]
-    df_data = df_data.drop([4], axis=1)
-    
-    df_data = df_data.apply(pandas.to_numeric)
-    df_data.reset_index(drop=True, inplace=True)
-    df_data.set_axis(["chunk", "coord", "Ncount", "dens"], axis = 1, inplace = True)
-    
-    n_chunks = df_data.iloc[0,1]
-    lines = n_chunks+1
-    chunk_list = list(range(1, int(lines), 1))
+
+    with instrumentation.reader_call('chunk_dens', filename) as call:
+        names, timesteps, counts, rows = _read_block_rows(filename, call)
+    df_data = pandas.DataFrame(rows[:, :4], columns=["chunk", "coord", "Ncount", "dens"])
+    df_data['chunk'] = df_data['chunk'].astype(numpy.int64)
+
+    averages = ave_chunk_average(df_data, columns=['dens'], by='chunk')
     df_avg = pandas.DataFrame()
-    coords = df_data.coord[1:int(lines)].values
-    
-    df_avg['chunk'] = chunk_list
-    df_avg['coord'] = coords
-    df_avg['dens'] = numpy.nan
-    df_avg['std'] = numpy.nan
-    
-    for i in chunk_list:
-        df_avg.loc[i-1, 'dens'] = numpy.mean(df_data.dens[df_data.chunk==i])
-        df_avg.loc[i-1, 'std'] = numpy.std(df_data.dens[df_data.chunk==i])
+    df_avg['chunk'] = averages.index.values
+    df_avg['coord'] = df_data.groupby('chunk')['coord'].first().values
+    df_avg['dens'] = averages['mean', 'dens'].values
+    df_avg['std'] = averages['std', 'dens'].values
 
     return df_data, df_avg
 
 # Reads data from LAMMPS fix ave/chunk file
 # Variable number of chunks supported
+# Returns a dictionary timestep -> DataFrame of chunk rows
 
 def read_ave_chunk(filename):
-    print('Reading file: {}'.format(filename))
-    df_data = pandas.read_csv(filename)
-    df_data.set_axis(['i'], axis = 1, inplace = True)
-    df_data = df_data.i.str.split(expand=True)
-    header = numpy.array(df_data.iloc[2,0:3].values).astype(float)
-    column_names = list(df_data.iloc[1,1:].values)
-    df_data = df_data.iloc[2:,:-1]
-    df_data.reset_index(drop = True, inplace = True)
-    df_data.columns = column_names
-    df_data = df_data.apply(pandas.to_numeric)
-    number_of_chunks = list()
-    timesteps = list()
-    number_of_chunks.append(int(df_data.iloc[0,1]))
-    timesteps.append(int(df_data.iloc[0,0]))
-    current_line = 0
-    while current_line < len(df_data)-(number_of_chunks[-1]+1):
-        current_line = current_line+(number_of_chunks[-1]+1)
-        number_of_chunks.append(int(df_data.iloc[current_line,1]))
-        timesteps.append(int(df_data.iloc[current_line,0]))
-    lines_per_timestep = numpy.array(number_of_chunks)+1
-    end_indicies = numpy.cumsum(lines_per_timestep)
-    start_indicies = scipy.ndimage.interpolation.shift(end_indicies, 1, cval = 0)
+    instrumentation.logger.info('Reading file: %s', filename)
+    with instrumentation.reader_call('read_ave_chunk', filename) as call:
+        names, timesteps, counts, rows = _read_block_rows(filename, call)
+    df_data = _ave_chunk_frame(names, rows)
+    end_indicies = numpy.cumsum(counts)
+    start_indicies = end_indicies - counts
     data_dict = {}
-    i = 0
-    while i < len(start_indicies):
-         data_dict[timesteps[i]]=df_data.iloc[start_indicies[i]+1:end_indicies[i]]
-         i = i + 1
-    print('File processed: {}'.format(filename))
+    for timestep, start, end in zip(timesteps, start_indicies, end_indicies):
+        data_dict[timestep] = df_data.iloc[start:end]
+    instrumentation.logger.info('File processed: %s', filename)
 
     return data_dict
+
+#---------------------------------------------------
+# Reads a LAMMPS fix ave/chunk file into a dense array.
+# Returns:
+#   timesteps -- (n_timesteps,) int64
+#   data      -- (n_timesteps, n_chunks, n_columns) masked
+#                array; with a variable number of chunks
+#                the missing rows of shorter frames are
+#                masked (max n_chunks is used)
+#   names     -- column names of the last axis
+# columns -- optional subset of column names
+# dtype   -- dtype of the data array (e.g. numpy.float32)
+#---------------------------------------------------
+
+def read_ave_chunk_array(filename, columns=None, dtype=numpy.float64):
+    with instrumentation.reader_call('read_ave_chunk_array', filename) as call:
+        names, timesteps, counts, rows = _read_block_rows(filename, call)
+    return (timesteps,) + _block_array(names, counts, rows, columns, dtype, filename)
+
+#---------------------------------------------------
+# Time average of fix ave/chunk data grouped by chunk.
+# source  -- filename or a DataFrame of chunk rows
+# columns -- columns to average (default: all but by)
+# by      -- column to group by (default: first column,
+#            i.e. the chunk ID)
+# Returns a DataFrame indexed by chunk with a two level
+# column index: ('mean', column) and ('std', column).
+#---------------------------------------------------
+
+def ave_chunk_average(source, columns=None, by=None, ddof=0):
+    if isinstance(source, pandas.DataFrame):
+        df_data = source
+    else:
+        with instrumentation.reader_call('ave_chunk_average', source) as call:
+            names, timesteps, counts, rows = _read_block_rows(source, call)
+        df_data = _ave_chunk_frame(names, rows)
+    if by is None:
+        by = df_data.columns[0]
+    if columns is None:
+        columns = [c for c in df_data.columns if c != by]
+    grouped = df_data.groupby(by)[list(columns)]
+    return pandas.concat({'mean': grouped.mean(), 'std': grouped.std(ddof=ddof)}, axis=1)
+
+#---------------------------------------------------
+# Parses a fix ave/chunk or fix ave/time vector file in
+# one read_csv call. Frame header lines (Timestep
+# Number-of-chunks/rows [Total-count]) are located from
+# the row counts: with a constant number of rows by a
+# strided check, otherwise by hopping from header to
+# header.
+# Returns column names, timesteps, rows per frame and
+# the (n_rows, n_columns) float64 array of data rows.
+# The counters and phases of the instrumentation.reader_call
+# call are filled in.
+#---------------------------------------------------
+
+def _read_block_rows(filename, call):
+    with call.phase('index'):
+        names = _read_comments(filename)[-1].split()[1:]
+    call.bytes_read = os.path.getsize(filename)
+
+    with call.phase('parse'):
+        table = pandas.read_csv(filename, sep=r'\s+', header=None, comment='#',
+                                names=range(len(names)), dtype=numpy.float64).to_numpy()
+    if len(table) == 0:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return names, empty, empty, numpy.zeros((0, len(names)))
+
+    with call.phase('index'):
+        names, timesteps, counts, rows = _locate_blocks(names, table)
+    call.frames_parsed = len(timesteps)
+    return names, timesteps, counts, rows
+
+# Frame header lines of a parsed block file, see _read_block_rows
+def _locate_blocks(names, table):
+    n_chunks = table[0, 1]
+    heads = numpy.arange(0, len(table), int(n_chunks) + 1)
+    if len(table) % (int(n_chunks) + 1) or numpy.any(table[heads, 1] != n_chunks):
+        heads = []
+        i = 0
+        while i < len(table):
+            heads.append(i)
+            i += int(table[i, 1]) + 1
+        heads = numpy.array(heads)
+
+    timesteps = table[heads, 0].astype(numpy.int64)
+    counts = table[heads, 1].astype(numpy.int64)
+    # a frame still being written only keeps its complete rows
+    counts[-1] = min(counts[-1], len(table) - heads[-1] - 1)
+    is_row = numpy.ones(len(table), dtype=bool)
+    is_row[heads] = False
+    return names, timesteps, counts, table[is_row]
+
+# DataFrame of chunk rows with an integer chunk ID column
+def _ave_chunk_frame(names, rows):
+    df_data = pandas.DataFrame(rows, columns=names)
+    df_data[names[0]] = df_data[names[0]].astype(numpy.int64)
+    return df_data
+
+#---------------------------------------------------
+# Scatters block rows into a dense (n_frames, n_rows,
+# n_columns) masked array; rows missing from shorter
+# frames are masked.
+#---------------------------------------------------
+
+def _block_array(names, counts, rows, columns, dtype, filename):
+    if columns is not None:
+        missing = [c for c in columns if c not in names]
+        if missing:
+            raise ValueError('Unknown columns {} in {}'.format(missing, filename))
+        rows = rows[:, [names.index(c) for c in columns]]
+        names = list(columns)
+    rows = rows.astype(dtype, copy=False)
+
+    n_rows = counts.max() if len(counts) else 0
+    if numpy.all(counts == n_rows):
+        data = rows.reshape(len(counts), n_rows, len(names))
+        return numpy.ma.MaskedArray(data), names
+
+    frame_index = numpy.repeat(numpy.arange(len(counts)), counts)
+    starts = numpy.cumsum(counts) - counts
+    row_index = numpy.arange(len(rows)) - numpy.repeat(starts, counts)
+    data = numpy.zeros((len(counts), n_rows, len(names)), dtype=dtype)
+    mask = numpy.ones((len(counts), n_rows, len(names)), dtype=bool)
+    data[frame_index, row_index] = rows
+    mask[frame_index, row_index] = False
+    return numpy.ma.MaskedArray(data, mask=mask), names
+
+# Leading "#" lines of a LAMMPS fix output file
+def _read_comments(filename):
+    comments = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            comments.append(line)
+    return comments
+
+# fix ave/time mode vector files announce the row count
+def _is_vector_file(comments):
+    return len(comments) >= 3 and 'Number-of-rows' in comments[-2]
@@ -6,10 +6,24 @@ Created on Tue Apr 28 14:46:57 2020
 @author: Johannes Gäding
 """
 
-import numpy
-import pandas
-import trajectory
-import lammps
-import functions
-import pickle_functions
-import system
+import importlib
+
+#---------------------------------------------------
+# The submodules (and numpy / pandas) are imported on
+# first access, e.g. lammps_py3.trajectory, so a script
+# reading only xyz or lammpstrj files never imports
+# pandas.
+#---------------------------------------------------
+
+__all__ = ['numpy', 'pandas', 'trajectory', 'lammps', 'functions', 'pickle_functions',
+           'system', 'analysis', 'binary_trajectory', 'correlation', 'instrumentation']
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module(name)
+        globals()[name] = module
+        return module
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -6,6 +6,14 @@
 
 import pickle
 import bz2
+import concurrent.futures
+import gzip
+import json
+import lzma
+import mmap as _mmap
+import os
+import struct
+import zlib
 
 # Load any compressed pickle file
 def decompress_pickle(file):
@@ -30,3 +38,112 @@ def full_pickle(title, data):
     pickle.dump(data, pikd)
     pikd.close()  
    
+
+#---------------------------------------------------
+# Array-aware pickles (.pk5) for large numpy arrays and DataFrames.
+#
+# The object is pickled with protocol 5 and its array buffers are written
+# out-of-band, i.e. directly from the arrays into the file without a copy
+# into the pickle stream. Every segment (pickle stream and buffers) is
+# stored either raw, 64-byte aligned, or compressed in independent blocks
+# of block_size bytes, which are (de)compressed by a pool of threads
+# (zlib, bz2 and lzma release the GIL).
+#
+# compression ... one of compressors: 'none', 'zlib', 'gzip', 'bz2', 'lzma'
+# level       ... compression level, default of the compressor if None
+# threads     ... number of compression threads, all cores if None
+#
+# Uncompressed files can be loaded with mmap=True: the arrays are then
+# read-only views of the memory-mapped file, read from disk on access.
+#
+# File layout: magic, segments, JSON footer, footer length (8 bytes), magic.
+#---------------------------------------------------
+
+pk5_magic = b'LAPY3PK5'
+pk5_version = 1
+pk5_alignment = 64
+
+# name: (compress(data, level), decompress(data)), more can be registered
+compressors = {
+    'zlib': (lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress),
+    'gzip': (lambda data, level: gzip.compress(data, 6 if level is None else level, mtime=0), gzip.decompress),
+    'bz2': (lambda data, level: bz2.compress(data, 9 if level is None else level), bz2.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+# Saves the "data" with the "title" and adds the .pk5
+def array_pickle(title, data, compression='none', level=None, threads=None, block_size=1 << 22):
+    if compression != 'none' and compression not in compressors:
+        raise ValueError('Unknown compression "{c}". Choose one of none, {names}.'.format(c=compression, names=', '.join(compressors)))
+    buffers = list()
+    stream = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+    segments = [memoryview(stream)] + [buffer.raw() for buffer in buffers]
+    footer = {'version': pk5_version, 'compression': compression, 'block_size': block_size, 'segments': list()}
+    with open(title + '.pk5', 'wb') as f, concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        f.write(pk5_magic)
+        for segment in segments:
+            segment = segment.cast('B')
+            if compression == 'none':
+                f.write(b'\0' * (-f.tell() % pk5_alignment))
+                footer['segments'].append({'offset': f.tell(), 'size': len(segment), 'blocks': []})
+                f.write(segment)
+                continue
+            compress = compressors[compression][0]
+            blocks = [segment[i:i+block_size] for i in range(0, len(segment), block_size)]
+            info = {'offset': f.tell(), 'size': len(segment), 'blocks': []}
+            for block in executor.map(compress, blocks, [level] * len(blocks)):
+                f.write(block)
+                info['blocks'].append(len(block))
+            footer['segments'].append(info)
+        encoded = json.dumps(footer).encode()
+        f.write(encoded)
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(pk5_magic)
+
+# Loads .pk5 files as well as .pbz2 and plain .pickle files
+def load_pickle(file, mmap=False, threads=None):
+    with open(file, 'rb') as f:
+        start = f.read(len(pk5_magic))
+    if start == pk5_magic:
+        return _load_pk5(file, mmap, threads)
+    if start[:3] == b'BZh':
+        return decompress_pickle(file)
+    return loosen(file)
+
+def _load_pk5(file, mmap, threads):
+    with open(file, 'rb') as f:
+        f.seek(-8 - len(pk5_magic), os.SEEK_END)
+        length = struct.unpack('<Q', f.read(8))[0]
+        if f.read(len(pk5_magic)) != pk5_magic:
+            raise ValueError('Truncated pk5 file "{file}".'.format(file=file))
+        f.seek(-8 - len(pk5_magic) - length, os.SEEK_END)
+        footer = json.loads(f.read(length))
+        if footer['version'] > pk5_version:
+            raise ValueError('pk5 file "{file}" has unsupported version {v}.'.format(file=file, v=footer['version']))
+        compression = footer['compression']
+        if mmap and compression != 'none':
+            raise ValueError('Only uncompressed pk5 files can be memory-mapped.')
+        segments = list()
+        if mmap:
+            view = memoryview(_mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ))
+            for info in footer['segments']:
+                segments.append(view[info['offset']:info['offset']+info['size']])
+        elif compression == 'none':
+            for info in footer['segments']:
+                segment = bytearray(info['size'])
+                f.seek(info['offset'])
+                f.readinto(segment)
+                segments.append(segment)
+        else:
+            decompress = compressors[compression][1]
+            with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+                for info in footer['segments']:
+                    f.seek(info['offset'])
+                    blocks = [f.read(size) for size in info['blocks']]
+                    segment = bytearray(info['size'])
+                    position = 0
+                    for block in executor.map(decompress, blocks):
+                        segment[position:position+len(block)] = block
+                        position += len(block)
+                    segments.append(segment)
+    return pickle.loads(segments[0], buffers=segments[1:])
@@ -6,7 +6,23 @@ Created on Tue Apr 28 14:46:57 2020
 """
 
 import numpy
-import pandas
+
+#---------------------------------------------------
+# Minimum image convention for distance vectors d[..., 3] in place.
+# Components along periodic axes (pbc == 1) are shifted by multiples of the
+# box length into [-L/2, L/2]. All axes are handled in one pass with a single
+# temporary of the size of d.
+#---------------------------------------------------
+
+def minimum_image(d, box_length, pbc):
+    periodic = numpy.array(pbc) == 1
+    length = numpy.where(periodic, box_length, 0).astype(d.dtype)
+    inverse = numpy.divide(1, length, out=numpy.zeros_like(length), where=periodic)
+    shift = numpy.multiply(d, inverse)
+    numpy.round(shift, out=shift)
+    shift *= length
+    d -= shift
+    return d
 
 class system:
     def __init__(self, positions, box, pbc = [1,1,1]):
@@ -31,46 +47,139 @@ class system:
             raise Exception('Provided box is not in the corract shape. Please provide the boxsize either as (3,) or (3,2) array. [lx, ly, lz] or [[xlo, xhi], [ylo, yhi], [zlo, zhi]]')
         self.lx, self.ly, self.lz = self.xhi - self.xlo, self.yhi - self.ylo, self.zhi - self.zlo
 
-    def self_distances(self):
-        self.x_dist = numpy.transpose(self.positions[:,0][numpy.newaxis])-self.positions[:,0]
-        self.y_dist = numpy.transpose(self.positions[:,1][numpy.newaxis])-self.positions[:,1]
-        self.z_dist = numpy.transpose(self.positions[:,2][numpy.newaxis])-self.positions[:,2]
-        if self.pbc[0] == 1:
-            self.x_dist[numpy.abs(self.x_dist)>=self.lx] = self.x_dist[numpy.abs(self.x_dist)>=self.lx]-(numpy.fix(self.x_dist[numpy.abs(self.x_dist)>=self.lx]/self.lx)*self.lx)
-        if self.pbc[1] == 1:
-            self.y_dist[numpy.abs(self.y_dist)>=self.ly] = self.y_dist[numpy.abs(self.y_dist)>=self.ly]-(numpy.fix(self.y_dist[numpy.abs(self.y_dist)>=self.ly]/self.ly)*self.ly)
-        if self.pbc[2] == 1:
-            self.z_dist[numpy.abs(self.z_dist)>=self.lz] = self.z_dist[numpy.abs(self.z_dist)>=self.lz]-(numpy.fix(self.z_dist[numpy.abs(self.z_dist)>=self.lz]/self.lz)*self.lz)
-
-        self.r_dist = numpy.sqrt(self.x_dist**2+self.y_dist**2+self.z_dist**2)
-
+    # Full distance matrix of the positions with themselves. For chunk_size
+    # None the minimum image vector components are kept as x_dist, y_dist and
+    # z_dist. With a chunk_size the matrix is filled in blocks of chunk_size
+    # rows, so only the result and a (chunk_size,N,3) block are in memory.
+    def self_distances(self, dtype=numpy.float64, chunk_size=None):
+        self.r_dist = self.distances(self.positions, dtype=dtype, chunk_size=chunk_size)
         return self.r_dist
 
-    def distances(self, second_positions):
-        self.x_dist = numpy.transpose(self.positions[:,0][numpy.newaxis])-second_positions[:,0]
-        self.y_dist = numpy.transpose(self.positions[:,1][numpy.newaxis])-second_positions[:,1]
-        self.z_dist = numpy.transpose(self.positions[:,2][numpy.newaxis])-second_positions[:,2]
-        if self.pbc[0] == 1:
-            self.x_dist[numpy.abs(self.x_dist)>=self.lx] = self.x_dist[numpy.abs(self.x_dist)>=self.lx]-(numpy.fix(self.x_dist[numpy.abs(self.x_dist)>=self.lx]/self.lx)*self.lx)
-        if self.pbc[1] == 1:
-            self.y_dist[numpy.abs(self.y_dist)>=self.ly] = self.y_dist[numpy.abs(self.y_dist)>=self.ly]-(numpy.fix(self.y_dist[numpy.abs(self.y_dist)>=self.ly]/self.ly)*self.ly)
-        if self.pbc[2] == 1:
-            self.z_dist[numpy.abs(self.z_dist)>=self.lz] = self.z_dist[numpy.abs(self.z_dist)>=self.lz]-(numpy.fix(self.z_dist[numpy.abs(self.z_dist)>=self.lz]/self.lz)*self.lz)
-
-        distances = numpy.sqrt(self.x_dist**2+self.y_dist**2+self.z_dist**2)
-
+    def distances(self, second_positions, dtype=numpy.float64, chunk_size=None):
+        first = self.positions.astype(dtype, copy=False)
+        second = numpy.asarray(second_positions).astype(dtype, copy=False)
+        if chunk_size is None:
+            d = first[:,numpy.newaxis,:] - second[numpy.newaxis,:,:]
+            minimum_image(d, self.box_length, self.pbc)
+            self.x_dist, self.y_dist, self.z_dist = d[:,:,0], d[:,:,1], d[:,:,2]
+            return numpy.sqrt(numpy.einsum('ijk,ijk->ij', d, d))
+        distances = numpy.empty((len(first), len(second)), dtype=dtype)
+        for start in range(0, len(first), chunk_size):
+            d = first[start:start+chunk_size,numpy.newaxis,:] - second[numpy.newaxis,:,:]
+            minimum_image(d, self.box_length, self.pbc)
+            numpy.sqrt(numpy.einsum('ijk,ijk->ij', d, d), out=distances[start:start+chunk_size])
         return distances
 
+    # Pairs of atoms closer than cutoff, found with a cell list instead of the
+    # full distance matrix. Memory and time scale with N for a fixed density.
+    # Periodic axes (pbc) are wrapped into box_limits and use the minimum
+    # image, non-periodic axes span the range of the positions.
+    # Returns the pair indices (i < j) as numpy.array(P,2) and their distances.
+    # Every pair is found once at its minimum image distance only, so the
+    # cutoff may not exceed half of the shortest periodic box length.
+    # Cells are cutoff / subdivisions long and all cells within the cutoff
+    # are searched, so fewer candidate pairs beyond the cutoff are built
+    # than with cells of the cutoff length (subdivisions=1).
+    def neighbors(self, cutoff, subdivisions=2):
+        periodic = [self.box_length[axis] for axis in range(3) if self.pbc[axis] == 1]
+        if periodic and cutoff > min(periodic) / 2:
+            raise ValueError('Cutoff {cutoff} exceeds half of the shortest periodic box length {length}, '
+                             'pairs beyond the minimum image would be missed.'.format(cutoff=cutoff, length=min(periodic)))
+        n_atoms = len(self.positions)
+        if n_atoms == 0:
+            return numpy.zeros((0, 2), dtype=numpy.int64), numpy.zeros(0)
+        coords = list()
+        extents = list()
+        for axis in range(3):
+            if self.pbc[axis] == 1:
+                coords.append(numpy.mod(self.positions[:,axis] - self.box_limits[axis][0], self.box_length[axis]))
+                extents.append(self.box_length[axis])
+            else:
+                coords.append(self.positions[:,axis] - numpy.min(self.positions[:,axis]))
+                extents.append(numpy.max(coords[-1]))
+        # Cells are at least cutoff / subdivisions long and, in sparse
+        # systems, large enough to hold about one atom, so there are at most
+        # of the order of n_atoms cells.
+        min_length = max(cutoff / subdivisions, (numpy.prod(numpy.maximum(extents, cutoff)) / n_atoms)**(1/3))
+        n_cells = numpy.ones(3, dtype=numpy.int64)
+        cell_lengths = numpy.zeros(3)
+        cells = numpy.zeros((n_atoms, 3), dtype=numpy.int64)
+        shifts = list()
+        for axis in range(3):
+            if self.pbc[axis] == 1:
+                n_cells[axis] = max(1, int(extents[axis] // min_length))
+                reach = int(numpy.ceil(cutoff / (extents[axis] / n_cells[axis]) - 1e-9))
+                # If the cells within reach on both sides coincide, the
+                # axis is not divided at all.
+                if n_cells[axis] < 2 * reach + 1:
+                    n_cells[axis] = 1
+                cell_lengths[axis] = extents[axis] / n_cells[axis]
+            else:
+                n_cells[axis] = int(extents[axis] // min_length) + 1
+                cell_lengths[axis] = min_length
+            if n_cells[axis] == 1:
+                shifts.append((0,))
+            else:
+                reach = int(numpy.ceil(cutoff / cell_lengths[axis] - 1e-9))
+                shifts.append(range(-reach, reach + 1))
+            cells[:,axis] = numpy.clip(numpy.floor(coords[axis] / cell_lengths[axis]), 0, n_cells[axis] - 1)
+
+        # Only occupied cells are indexed (sorted cell ids), so memory
+        # scales with the number of atoms and not with the box volume.
+        cell_id = numpy.ravel_multi_index(cells.T, n_cells)
+        order = numpy.argsort(cell_id, kind='stable')
+        occupied, starts, counts = numpy.unique(cell_id[order], return_index=True, return_counts=True)
+
+        pairs = list()
+        distances = list()
+        for sx in shifts[0]:
+            for sy in shifts[1]:
+                for sz in shifts[2]:
+                    # Every pair of cells is visited once (half stencil),
+                    # pairs within the same cell are taken with i < j.
+                    if (sx, sy, sz) < (0, 0, 0):
+                        continue
+                    # cells whose closest points are beyond the cutoff
+                    gap = numpy.maximum(numpy.abs([sx, sy, sz]) - 1, 0) * cell_lengths
+                    if numpy.sum(gap**2) >= cutoff**2:
+                        continue
+                    neighbor_cells = cells + numpy.array([sx, sy, sz])
+                    valid = numpy.ones(n_atoms, dtype=bool)
+                    for axis in range(3):
+                        if self.pbc[axis] == 1:
+                            neighbor_cells[:,axis] = numpy.mod(neighbor_cells[:,axis], n_cells[axis])
+                        else:
+                            valid &= (neighbor_cells[:,axis] >= 0) & (neighbor_cells[:,axis] < n_cells[axis])
+                    i_atoms = numpy.flatnonzero(valid)
+                    neighbor_id = numpy.ravel_multi_index(neighbor_cells[i_atoms].T, n_cells)
+                    slot = numpy.minimum(numpy.searchsorted(occupied, neighbor_id), len(occupied) - 1)
+                    n_j = numpy.where(occupied[slot] == neighbor_id, counts[slot], 0)
+                    first = numpy.cumsum(n_j) - n_j
+                    i = numpy.repeat(i_atoms, n_j)
+                    j = order[numpy.repeat(starts[slot] - first, n_j) + numpy.arange(len(i))]
+                    if (sx, sy, sz) == (0, 0, 0):
+                        i, j = i[i < j], j[i < j]
+                    d = self.positions[j] - self.positions[i]
+                    minimum_image(d, self.box_length, self.pbc)
+                    r = numpy.sqrt(numpy.einsum('ij,ij->i', d, d))
+                    within = r < cutoff
+                    pairs.append(numpy.column_stack((numpy.minimum(i, j)[within], numpy.maximum(i, j)[within])))
+                    distances.append(r[within])
+
+        return numpy.vstack(pairs), numpy.hstack(distances)
+
     def density_profile(self, axis, bin_width=0.5, min_coord = None, max_coord = None):
         if min_coord==None:
             min_coord = self.box_limits[axis][0]
         if max_coord==None:
             max_coord = self.box_limits[axis][1]
         bins = numpy.arange(min_coord, max_coord, bin_width)
-        hist_data = numpy.histogram(numpy.digitize(self.positions[:,axis], bins), bins=bins)
+        index = numpy.floor((self.positions[:,axis] - min_coord) / bin_width).astype(numpy.int64)
+        index = index[(index >= 0) & (index < len(bins) - 1)]
+        hist_data = numpy.bincount(index, minlength=len(bins) - 1)
         plot_bins = (bins+bin_width/2)[:-1]
 
-        return hist_data[0], plot_bins
+        return hist_data, plot_bins
 
 # import numpy as np
 # import freud as fd
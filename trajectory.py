@@ -5,8 +5,699 @@ Created on Tue Apr 28 14:46:57 2020
 @author: Johannes Gäding
 """
 
+import collections
+import concurrent.futures
+import functools
+import io
+import mmap
+import os
+import pickle
+import threading
+import time
+import zipfile
 import numpy
-import pandas
+
+import instrumentation
+
+#---------------------------------------------------
+# Shared base of the trajectory classes.
+#
+# Frames are located by their byte offsets in the file. In 'memory' mode
+# the file content is additionally kept as list of lines, in 'stream' mode
+# every frame is read from disk when it is accessed. In 'mmap' mode the file
+# is memory-mapped read-only and frames are slices (memoryview) of the map,
+# so processes reading the same file share its pages in the page cache.
+# Reading a frame does not copy it; parsing copies the atom lines of the
+# frame once into the buffer of the parser (see _parse_block).
+#
+# With index_file=True (or a path) the frame index is stored in a binary
+# sidecar next to the trajectory (<filepath>.idx.npz). The sidecar is
+# validated against size and mtime of the trajectory and is extended if
+# frames were appended since it was written.
+#
+# Pickled trajectories carry only path and frame index and reopen the file
+# on unpickling ('memory' mode becomes 'stream'). map_frames() uses this to
+# hand the trajectory to a process pool.
+#
+# Indexing and iteration return frame objects (xyz_frame, lammpstrj_frame)
+# that keep their own frame number, so any number of frames can be held at
+# once and a trajectory can be shared between threads. Slices and lists of
+# frame numbers read runs of adjacent frames with a single read.
+#
+# With cache_bytes > 0 parsed arrays of all frames are additionally kept in
+# a frame_cache of that size (<trajectory>.cache), so revisiting a frame
+# does not parse its text again.
+#
+# Files still being written are followed with refresh(), which only scans
+# the bytes appended since the last index. With follow=True a last line
+# without trailing newline is treated as incomplete, so a partially written
+# frame is never indexed; tail() and atail() yield frames as they appear.
+#---------------------------------------------------
+
+class _trajectory:
+
+    modes = ('memory', 'stream', 'mmap')
+    header_length = 0
+    index_fields = ('atoms_per_frame',)
+    text_fields = ()
+    index_version = 1
+    frame_class = None
+
+    def __init__(self, filepath, mode='memory', index_file=False, cache_bytes=0, follow=False):
+        if mode not in self.modes:
+            raise ValueError('Unknown mode "{mode}". Choose one of {modes}.'.format(mode=mode, modes=self.modes))
+        self.path = filepath
+        self.mode = mode
+        self.follow = follow
+        self._file = None
+        self._map = None
+        self._view = None
+        self._lock = threading.Lock()
+        self.cache = frame_cache(cache_bytes) if cache_bytes > 0 else None
+        with instrumentation.reader_call(type(self).__name__, filepath) as call:
+            if self.mode == 'memory':
+                self.content = self.__file_content()
+                call.bytes_read += os.path.getsize(filepath)
+            else:
+                self.content = None
+            with call.phase('index'):
+                call.bytes_read += self.__get_traj_properties(index_file)
+            self.__count_lines()
+        self.frame = 0
+
+    def __count_lines(self):
+        self.start_line_per_frame = numpy.hstack(([0], numpy.cumsum(numpy.array(self.atoms_per_frame) + self.header_length)[:-1]))
+        if self.mode == 'memory':
+            self.n_lines = len(self.content)
+        else:
+            self.n_lines = int(numpy.sum(numpy.array(self.atoms_per_frame) + self.header_length))
+        self.n_frames = len(self.atoms_per_frame)
+
+    def close(self):
+        self.__release_map()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Frames still holding slices of the map keep it alive until they
+    # are gone, the next read maps the file again.
+    def __release_map(self):
+        if self._map is not None:
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                pass
+            self._map = None
+            self._view = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __file_content(self):
+        with open(self.path) as f:
+            contents = f.readlines()
+        return contents
+
+    # Positional reads (os.pread) do not move a shared file pointer, so
+    # threads can read concurrently. Without pread the read is locked.
+    def _read_bytes(self, start, stop):
+        if self._file is None or (self.mode == 'mmap' and self._map is None):
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self.path, 'rb')
+                if self.mode == 'mmap' and self._map is None:
+                    self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._view = memoryview(self._map)
+        if self.mode == 'mmap':
+            return self._view[start:stop]
+        if hasattr(os, 'pread'):
+            chunks = list()
+            while start < stop:
+                chunk = os.pread(self._file.fileno(), stop - start, start)
+                if len(chunk) == 0:
+                    break
+                chunks.append(chunk)
+                start += len(chunk)
+            return b''.join(chunks)
+        with self._lock:
+            self._file.seek(start)
+            return self._file.read(stop - start)
+
+    # Frames of the given frame numbers. Runs of adjacent frames are read
+    # with one read of at most scan_chunk_size bytes and shared by the frames.
+    def _iter_frames(self, frames):
+        frames = [self.__frame_number(i) for i in frames]
+        if self.mode == 'memory':
+            for i in frames:
+                yield self.frame_class(self, i)
+            return
+        first = 0
+        while first < len(frames):
+            last = first
+            start = self.frame_offsets[frames[first]]
+            while (last + 1 < len(frames) and frames[last+1] == frames[last] + 1
+                   and self.frame_offsets[frames[last+1]+1] - start <= scan_chunk_size):
+                last += 1
+            raw = memoryview(self._read_bytes(start, self.frame_offsets[frames[last]+1]))
+            for i in frames[first:last+1]:
+                yield self.frame_class(self, i, raw[self.frame_offsets[i]-start:self.frame_offsets[i+1]-start])
+            first = last + 1
+
+    def __frame_number(self, i):
+        i = int(i)
+        if i < 0:
+            i += self.n_frames
+        if i < 0 or i >= self.n_frames:
+            raise IndexError('Frame {i} out of range for trajectory with {n} frames.'.format(i=i, n=self.n_frames))
+        return i
+
+    # Frame index: byte offsets of all frames (plus the end of the last
+    # complete frame) and of their first atom line, together with the
+    # per-frame properties of index_fields and text_fields. Returns the
+    # number of bytes scanned.
+    def __get_traj_properties(self, index_file):
+        if index_file is True:
+            index_path = os.fspath(self.path) + '.idx.npz'
+        else:
+            index_path = index_file or None
+        stat = os.stat(self.path)
+        index = None
+        updated = True
+        scanned = 0
+        if index_path is not None:
+            index = self.__read_index(index_path)
+        if index is not None and (index['file_size'], index['file_mtime']) == (stat.st_size, stat.st_mtime_ns):
+            updated = False
+        elif index is not None and self.__index_extendable(index, stat.st_size):
+            scanned = stat.st_size - int(index['frame_offsets'][-1])
+            index = self.__extend_index(index)
+        else:
+            scanned = stat.st_size
+            index = self.__extend_index(self.__empty_index())
+        index['file_size'], index['file_mtime'] = stat.st_size, stat.st_mtime_ns
+        if index_path is not None and updated:
+            self.__write_index(index_path, index)
+        self.frame_offsets = index['frame_offsets']
+        self.data_offsets = index['data_offsets']
+        self._last_header = index.get('last_header', b'')
+        for field in self.index_fields:
+            setattr(self, field, index[field].tolist())
+        for field in self.text_fields:
+            setattr(self, field, [line.decode().split() for line in index[field]])
+        return scanned
+
+    def __empty_index(self):
+        index = {'frame_offsets': numpy.zeros(1, dtype=numpy.int64), 'data_offsets': numpy.zeros(0, dtype=numpy.int64)}
+        for field in self.index_fields:
+            index[field] = numpy.zeros(0, dtype=numpy.int64)
+        for field in self.text_fields:
+            index[field] = list()
+        return index
+
+    # An index can be extended if the file only grew and the header of the
+    # last indexed frame is unchanged. A last frame that was terminated by
+    # the end of the file instead of a newline is indexed again.
+    def __index_extendable(self, index, file_size):
+        with open(self.path, 'rb') as f:
+            kept = self.__kept_frames(f, file_size, index['frame_offsets'], index['data_offsets'], index.get('last_header', b''))
+        if kept is None:
+            return False
+        if kept < len(index['data_offsets']):
+            index['frame_offsets'] = index['frame_offsets'][:kept+1]
+            index['data_offsets'] = index['data_offsets'][:kept]
+            for field in self.index_fields:
+                index[field] = index[field][:kept]
+            for field in self.text_fields:
+                index[field] = index[field][:kept]
+        return True
+
+    # Number of indexed frames that are still valid in file f, or None if
+    # the file was truncated or rewritten since it was indexed.
+    def __kept_frames(self, f, file_size, frame_offsets, data_offsets, last_header):
+        if frame_offsets[-1] > file_size:
+            return None
+        if len(data_offsets) == 0:
+            return 0
+        f.seek(frame_offsets[-2])
+        if f.read(data_offsets[-1] - frame_offsets[-2]) != last_header:
+            return None
+        f.seek(frame_offsets[-1] - 1)
+        if f.read(1) != b'\n':
+            return len(data_offsets) - 1
+        return len(data_offsets)
+
+    # Indexes the frames appended to the file since it was last indexed and
+    # returns the number of new frames. Only the appended bytes are scanned;
+    # a truncated or rewritten file is indexed again from the start. The
+    # frame cache is cleared whenever indexed frames changed. The index
+    # sidecar is not rewritten, it is extended the next time the trajectory
+    # is opened.
+    def refresh(self):
+        n_frames = self.n_frames
+        with open(self.path, 'rb') as f, instrumentation.reader_call(type(self).__name__ + '.refresh', self.path) as call:
+            file_size = os.fstat(f.fileno()).st_size
+            kept = self.__kept_frames(f, file_size, self.frame_offsets, self.data_offsets, self._last_header)
+            if kept is None:
+                kept = 0
+            if kept < n_frames and self.cache is not None:
+                self.cache.clear()
+            offset = int(self.frame_offsets[kept])
+            with call.phase('index'):
+                new = self._scan_frames(f, offset)
+            call.bytes_read = file_size - offset
+            if len(new['data_offsets']) > 0:
+                f.seek(new['frame_offsets'][-2])
+                self._last_header = f.read(new['data_offsets'][-1] - new['frame_offsets'][-2])
+            elif kept == 0:
+                self._last_header = b''
+            if self.mode == 'memory':
+                f.seek(offset)
+                lines = io.TextIOWrapper(io.BytesIO(f.read(new['frame_offsets'][-1] - offset))).readlines()
+                n_lines = int(numpy.sum(numpy.array(self.atoms_per_frame[:kept]) + self.header_length))
+                self.content = self.content[:n_lines] + lines
+        self.frame_offsets = numpy.hstack((self.frame_offsets[:kept], numpy.array(new['frame_offsets'], dtype=numpy.int64)))
+        self.data_offsets = numpy.hstack((self.data_offsets[:kept], numpy.array(new['data_offsets'], dtype=numpy.int64)))
+        for field in self.index_fields:
+            setattr(self, field, getattr(self, field)[:kept] + list(new[field]))
+        for field in self.text_fields:
+            setattr(self, field, getattr(self, field)[:kept] + [line.decode().split() for line in new[field]])
+        self.__release_map()
+        self.__count_lines()
+        return self.n_frames - n_frames
+
+    # Yields the frames from frame start on and then every frame appended to
+    # the file, calling refresh() every poll_interval seconds while waiting.
+    # Stops once no frame was appended for timeout seconds (None: never).
+    # Open the trajectory with follow=True, so a partially written last
+    # frame is not yielded.
+    def tail(self, start=0, poll_interval=1.0, timeout=None):
+        i = start
+        last_new = time.monotonic()
+        while True:
+            if i < self.n_frames:
+                n_frames = self.n_frames
+                yield from self._iter_frames(range(i, n_frames))
+                i = n_frames
+                last_new = time.monotonic()
+            elif timeout is not None and time.monotonic() - last_new >= timeout:
+                return
+            else:
+                time.sleep(poll_interval)
+            self.refresh()
+
+    # Asynchronous version of tail() for asyncio applications, refresh()
+    # runs in a worker thread.
+    async def atail(self, start=0, poll_interval=1.0, timeout=None):
+        import asyncio
+        i = start
+        last_new = time.monotonic()
+        while True:
+            if i < self.n_frames:
+                n_frames = self.n_frames
+                for frame in self._iter_frames(range(i, n_frames)):
+                    yield frame
+                i = n_frames
+                last_new = time.monotonic()
+            elif timeout is not None and time.monotonic() - last_new >= timeout:
+                return
+            else:
+                await asyncio.sleep(poll_interval)
+            await asyncio.to_thread(self.refresh)
+
+    def __extend_index(self, index):
+        with open(self.path, 'rb') as f:
+            new = self._scan_frames(f, int(index['frame_offsets'][-1]))
+            if len(new['data_offsets']) > 0:
+                f.seek(new['frame_offsets'][-2])
+                index['last_header'] = f.read(new['data_offsets'][-1] - new['frame_offsets'][-2])
+        index['frame_offsets'] = numpy.hstack((index['frame_offsets'][:-1], numpy.array(new['frame_offsets'], dtype=numpy.int64)))
+        index['data_offsets'] = numpy.hstack((index['data_offsets'], numpy.array(new['data_offsets'], dtype=numpy.int64)))
+        for field in self.index_fields:
+            index[field] = numpy.hstack((index[field], numpy.array(new[field], dtype=numpy.int64)))
+        for field in self.text_fields:
+            index[field] = list(index[field]) + list(new[field])
+        return index
+
+    def __read_index(self, index_path):
+        try:
+            with numpy.load(index_path, allow_pickle=False) as stored:
+                if str(stored['format']) != type(self).__name__ or int(stored['version']) != self.index_version:
+                    return None
+                index = {'file_size': int(stored['file_size']), 'file_mtime': int(stored['file_mtime']),
+                         'frame_offsets': stored['frame_offsets'], 'data_offsets': stored['data_offsets'],
+                         'last_header': stored['last_header'].tobytes()}
+                for field in self.index_fields:
+                    index[field] = stored[field]
+                for field in self.text_fields:
+                    blob, ends = stored[field].tobytes(), stored[field + '_ends']
+                    index[field] = [blob[start:stop] for start, stop in zip(numpy.hstack(([0], ends[:-1])), ends)]
+        # a missing, truncated or foreign sidecar is scanned again
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        return index
+
+    # Written to a temporary file first, so concurrent readers never see a
+    # partially written sidecar. An unwritable location is not an error.
+    def __write_index(self, index_path, index):
+        arrays = {'format': numpy.array(type(self).__name__), 'version': numpy.array(self.index_version),
+                  'file_size': numpy.array(index['file_size']), 'file_mtime': numpy.array(index['file_mtime']),
+                  'frame_offsets': index['frame_offsets'], 'data_offsets': index['data_offsets'],
+                  'last_header': numpy.frombuffer(index.get('last_header', b''), dtype=numpy.uint8)}
+        for field in self.index_fields:
+            arrays[field] = index[field]
+        for field in self.text_fields:
+            arrays[field] = numpy.frombuffer(b''.join(index[field]), dtype=numpy.uint8)
+            arrays[field + '_ends'] = numpy.cumsum([len(line) for line in index[field]], dtype=numpy.int64)
+        tmp_path = '{path}.{pid}.tmp'.format(path=index_path, pid=os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                numpy.savez(f, **arrays)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # Applies func to every frame (or the given frame indices) in a pool of
+    # n_workers processes. The frames are split into contiguous chunks of
+    # chunksize frames, so every worker reads neighbouring frames. func must
+    # be picklable (defined at module level) and gets the selected trajectory,
+    # e.g. func(frame) -> frame.data(). Results are returned in frame order as
+    # list, or folded in frame order with reduce(accumulated, result).
+    def map_frames(self, func, n_workers=None, chunksize=None, frames=None, reduce=None):
+        if frames is None:
+            frames = range(self.n_frames)
+        frames = list(frames)
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        if chunksize is None:
+            chunksize = max(1, -(-len(frames) // (4 * n_workers)))
+        chunks = [frames[i:i+chunksize] for i in range(0, len(frames), chunksize)]
+        if n_workers == 1:
+            results = (_map_chunk(self, func, chunk) for chunk in chunks)
+            return _collect(results, reduce)
+        with concurrent.futures.ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(pickle.dumps(self),)) as executor:
+            results = executor.map(_map_chunk, [None] * len(chunks), [func] * len(chunks), chunks)
+            return _collect(results, reduce)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_map'] = None
+        state['_view'] = None
+        state['_lock'] = None
+        if self.mode == 'memory':
+            state['mode'] = 'stream'
+            state['content'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.n_frames
+
+    def __iter__(self):
+        return self._iter_frames(range(self.n_frames))
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            return list(self._iter_frames(range(*x.indices(self.n_frames))))
+        if numpy.ndim(x) > 0:
+            x = numpy.asarray(x)
+            if x.dtype == bool:
+                x = numpy.flatnonzero(x)
+            return list(self._iter_frames(x))
+        return next(self._iter_frames([x]))
+
+#---------------------------------------------------
+# Single frame of a trajectory, as returned by indexing and iteration.
+#
+# Header and atom lines are read when they are first needed (or taken from
+# the block read for a run of frames) and parsed arrays are cached in the
+# frame. The cached arrays are read-only and every call returns a copy, so
+# modifying a result never changes later reads.
+#
+# <frame>.frame         -- frame number in the trajectory - int
+# <frame>.trajectory    -- trajectory the frame belongs to
+#---------------------------------------------------
+
+class _frame:
+
+    __slots__ = ('trajectory', 'frame', '_raw', '_header', '_cache')
+
+    def __init__(self, trajectory, frame, raw=None):
+        self.trajectory = trajectory
+        self.frame = frame
+        self._raw = raw
+        self._header = None
+        self._cache = dict()
+
+    def __repr__(self):
+        return '<{cls} {frame} of "{path}">'.format(cls=type(self).__name__, frame=self.frame, path=self.trajectory.path)
+
+    def _header_lines(self):
+        if self._header is None:
+            traj = self.trajectory
+            if traj.mode == 'memory':
+                start = traj.start_line_per_frame[self.frame]
+                self._header = traj.content[start:start+traj.header_length]
+            elif self._raw is not None:
+                self._header = bytes(self._raw[:traj.data_offsets[self.frame]-traj.frame_offsets[self.frame]]).decode().splitlines()
+            else:
+                self._header = bytes(traj._read_bytes(traj.frame_offsets[self.frame], traj.data_offsets[self.frame])).decode().splitlines()
+        return self._header
+
+    def _atom_block(self):
+        traj = self.trajectory
+        if traj.mode == 'memory':
+            start = traj.start_line_per_frame[self.frame] + traj.header_length
+            return ''.join(traj.content[start:start+traj.atoms_per_frame[self.frame]]).encode()
+        if self._raw is not None:
+            return self._raw[traj.data_offsets[self.frame]-traj.frame_offsets[self.frame]:]
+        return traj._read_bytes(traj.data_offsets[self.frame], traj.frame_offsets[self.frame+1])
+
+    def _cached(self, key, parse):
+        return self._cached_group((key,), lambda: (parse(),))[0]
+
+    # Arrays parsed together in one pass (e.g. positions and atom types of
+    # an xyz frame) are cached under their own keys.
+    def _cached_group(self, keys, parse):
+        if not all(key in self._cache for key in keys):
+            cache = self.trajectory.cache
+            values = None
+            if cache is not None:
+                values = [cache.get((self.frame, key)) for key in keys]
+                if any(value is None for value in values):
+                    values = None
+            if values is None:
+                values = self.__parse(parse)
+                for value in values:
+                    value.flags.writeable = False
+                if cache is not None:
+                    for key, value in zip(keys, values):
+                        cache.put((self.frame, key), value)
+            self._cache.update(zip(keys, values))
+        return [self._cache[key].copy() for key in keys]
+
+    # Every parse of atom lines is one reader call of the instrumentation
+    def __parse(self, parse):
+        if not instrumentation.enabled():
+            return parse()
+        traj = self.trajectory
+        with instrumentation.reader_call(type(traj).__name__ + '.frame', traj.path) as call:
+            with call.phase('parse'):
+                value = parse()
+            call.bytes_read = int(traj.frame_offsets[self.frame+1] - traj.data_offsets[self.frame])
+            call.frames_parsed = 1
+        return value
+
+#---------------------------------------------------
+# LRU cache of parsed frame arrays bounded by max_bytes (sum of nbytes).
+# Entries are keyed by (frame number, parsed columns); the least recently
+# used entries are evicted first. Safe to use from several threads.
+#
+# <frame_cache>.hits, .misses   -- number of found and missing lookups - int
+# <frame_cache>.nbytes          -- bytes currently held - int
+#---------------------------------------------------
+
+class frame_cache:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        size = value.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1].nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<frame_cache {n} entries, {nbytes}/{max_bytes} bytes, {hits} hits, {misses} misses>'.format(
+            n=len(self), nbytes=self.nbytes, max_bytes=self.max_bytes, hits=self.hits, misses=self.misses)
+
+    # Pickled (e.g. for map_frames) without its entries.
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+#---------------------------------------------------
+# Process pool helpers of map_frames(). Every worker unpickles the
+# trajectory once and keeps it open for all of its chunks. It is passed
+# pickled, so forked workers do not share the file handle of the parent.
+#---------------------------------------------------
+
+_worker_trajectory = None
+
+def _init_worker(pickled_trajectory):
+    global _worker_trajectory
+    _worker_trajectory = pickle.loads(pickled_trajectory)
+
+def _map_chunk(traj, func, frames):
+    if traj is None:
+        traj = _worker_trajectory
+    return [func(traj[i]) for i in frames]
+
+def _collect(results, reduce):
+    results = (result for chunk in results for result in chunk)
+    if reduce is None:
+        return list(results)
+    return functools.reduce(reduce, results)
+
+#---------------------------------------------------
+# Frame scanner working on the raw bytes of a trajectory.
+#
+# The file is read in chunks of scan_chunk_size bytes. Line ends of a chunk
+# are located at once with numpy, so the python loop only runs once per
+# frame and never per atom line. Atom lines of frames larger than a chunk
+# are counted without keeping them in memory.
+#
+# Returns the byte offsets of all complete frames (plus the end of the last
+# one), the offsets of their first atom lines and their raw header lines.
+# A last line without trailing newline is terminated by the end of the file,
+# unless eof_terminates is False (files still being written).
+#---------------------------------------------------
+
+scan_chunk_size = 1 << 26
+
+#---------------------------------------------------
+# Parses the atom lines of a frame given as bytes in a single pass of the
+# C tokenizer of numpy.loadtxt. Only the columns in usecols are converted.
+# dtype is either a single dtype, giving a 2D array, or a structured dtype
+# with one field per column, giving a 1D record array.
+# A memoryview (mmap slice) is copied once into the BytesIO buffer.
+#---------------------------------------------------
+
+def _parse_block(block, n_rows, n_cols, usecols=None, dtype=float):
+    dtype = numpy.dtype(dtype)
+    if usecols is not None:
+        n_cols = len(usecols)
+    if n_rows == 0:
+        if dtype.names is not None:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.zeros((0, n_cols), dtype=dtype)
+    if dtype.names is not None:
+        dtype = _sized_text_fields(block, dtype, usecols)
+        return numpy.loadtxt(io.BytesIO(block), dtype=dtype, usecols=usecols, ndmin=1)
+    return numpy.loadtxt(io.BytesIO(block), dtype=dtype, usecols=usecols, ndmin=2)
+
+# Text fields given as plain str (e.g. 'element' in dtypes()) would be
+# zero-width strings inside a record dtype, they get the width of the
+# longest entry of the block instead.
+def _sized_text_fields(block, dtype, usecols):
+    text = [i for i, name in enumerate(dtype.names) if dtype[name].kind in 'SU' and dtype[name].itemsize == 0]
+    if not text:
+        return dtype
+    columns = [i if usecols is None else usecols[i] for i in text]
+    width = numpy.loadtxt(io.BytesIO(block), dtype=str, usecols=columns, ndmin=2).dtype
+    fields = list()
+    for i, name in enumerate(dtype.names):
+        if i in text:
+            fields.append((name, width if dtype[name].kind == 'U' else numpy.dtype(('S', width.itemsize // 4))))
+        else:
+            fields.append((name, dtype[name]))
+    return numpy.dtype(fields)
+
+def _scan_frames(f, offset, header_length, count_line, eof_terminates=True):
+    frame_offsets = [offset]
+    data_offsets = list()
+    headers = list()
+    f.seek(offset)
+    base = offset
+    buf = b''
+    pending = None
+    remaining = 0
+    eof = False
+    while not eof:
+        chunk = f.read(scan_chunk_size)
+        eof = len(chunk) == 0
+        buf = buf + chunk
+        ends = numpy.flatnonzero(numpy.frombuffer(buf, dtype=numpy.uint8) == 10) + 1
+        if eof and eof_terminates and len(buf) > 0 and buf[-1:] != b'\n':
+            ends = numpy.append(ends, len(buf))
+        n_ends = len(ends)
+        line = 0
+        consumed = 0
+        while True:
+            if pending is not None:
+                if n_ends - line < remaining:
+                    remaining -= n_ends - line
+                    line = n_ends
+                    if n_ends > 0:
+                        consumed = int(ends[-1])
+                    break
+                line += remaining
+                if line > 0:
+                    consumed = int(ends[line-1])
+                frame_offsets.append(base + consumed)
+                data_offsets.append(pending[0])
+                headers.append(pending[1])
+                pending = None
+            if n_ends - line < header_length:
+                break
+            header = buf[consumed:int(ends[line+header_length-1])].splitlines()
+            remaining = int(header[count_line])
+            line += header_length
+            consumed = int(ends[line-1])
+            pending = (base + consumed, header)
+        buf = buf[consumed:]
+        base += consumed
+    return frame_offsets, data_offsets, headers
 
 #---------------------------------------------------
 # Class for trajectories in .xyz-fileformat.
@@ -18,65 +709,74 @@ import pandas
 #
 # <xyz_trajectory>.positions()   	-- xyz-atom coords of selected frame - numpy.array(3,N)
 # <xyz_trajectory>.atom_types()	    -- atom-types of slected frame - numpy.array(1,N) - floats
+# <xyz_trajectory>[i]               -- frame i as xyz_frame with positions(), atom_types(), comment()
+# <xyz_trajectory>[a:b:c], [i, j]   -- list of xyz_frame, adjacent frames are read at once
+# <xyz_trajectory>.map_frames(func)  -- [func(frame) for all frames] evaluated in a process pool - list
+# <xyz_trajectory>.refresh()        -- index frames appended since the last index - number of new frames
+# <xyz_trajectory>.tail()           -- iterate over all frames, waiting for new ones (async: atail())
 #
 # porperties:
 #
-# <xyz_trajectory>.frame		    -- current selected frame - int
+# <xyz_trajectory>.frame		    -- frame used by positions() and atom_types() of the trajectory - int
 # <xyz_trajectory>.n_frames		    -- number of total frames in trajectory - int
 # <xyz_trajectory>.atoms_per_frame	-- number of atoms per timestep - list(N)
-# <xyz_trajectory>.content		    -- raw content of file as list(str)
+# <xyz_trajectory>.comments		    -- split comment line of every frame - list(list(str))
+# <xyz_trajectory>.content		    -- raw content of file as list(str) - None in 'stream' and 'mmap' mode
+# <xyz_trajectory>.frame_offsets	-- byte offset of each frame, last entry marks the end of the last frame - numpy.array(n_frames+1)
+# <xyz_trajectory>.data_offsets	    -- byte offset of the first atom line of each frame - numpy.array(n_frames)
+#
+# modes:
+#
+# xyz_trajectory(filepath, mode='memory')      -- whole file is read into <xyz_trajectory>.content
+# xyz_trajectory(filepath, mode='stream')      -- only the frame offsets are indexed, each frame is read from disk on demand
+# xyz_trajectory(filepath, mode='mmap')        -- file is memory-mapped, frames are slices of the map shared between processes (copied once when parsed)
+# xyz_trajectory(filepath, index_file=True)    -- frame index is stored in/loaded from <filepath>.idx.npz
+# xyz_trajectory(filepath, cache_bytes=2**30)  -- parsed frames are kept in an LRU cache of 1 GB, see <xyz_trajectory>.cache
+# xyz_trajectory(filepath, follow=True)        -- file is still being written, a partial last frame is left for refresh()
 #---------------------------------------------------
 
-class xyz_trajectory:
-    
-    def __init__(self, filepath):
-        self.path = filepath
-        self.content = self.__file_content()
-        self.n_lines = len(self.content)
-        self.atoms_per_frame, self.comments = self.__get_traj_properties()
-        self.start_line_per_frame = numpy.hstack(([0], numpy.cumsum(numpy.array(self.atoms_per_frame) + 2)[:-1]))
-        self.n_frames = len(self.atoms_per_frame)
-        self.iteration_started = False
-        self.__iter__()
+class xyz_frame(_frame):
 
-    def __file_content(self):
-        with open(self.path) as f:
-            contents = f.readlines()
-        return contents
-    
-    def __get_traj_properties(self):
-        atoms_per_frame = list()
-        comments = list()
-        line = 0
-        while line < self.n_lines:
-            atoms_per_frame.append(int(self.content[line]))
-            comments.append(self.content[line+1].split())
-            line = numpy.cumsum(numpy.array(atoms_per_frame)+2)[-1]
-        return atoms_per_frame, comments
+    __slots__ = ()
 
     def positions(self):
-        frame = self.content[self.start_line_per_frame[self.frame]+2:self.start_line_per_frame[self.frame]+self.atoms_per_frame[self.frame]+2]
-        return numpy.array([line.split() for line in frame])[:,1:4].astype(float)
+        return self.__atoms()[0]
+
+    def atom_types(self):
+        return self.__atoms()[1]
+
+    # Positions and atom types are read from the atom lines in one pass
+    def __atoms(self):
+        return self._cached_group(('positions', 'atom_types'), self.__parse_atoms)
+
+    def __parse_atoms(self):
+        record = _parse_block(self._atom_block(), self.trajectory.atoms_per_frame[self.frame], 4, usecols=(0, 1, 2, 3),
+                              dtype=[('type', str), ('x', float), ('y', float), ('z', float)])
+        return numpy.column_stack((record['x'], record['y'], record['z'])), record['type'].copy()
+
+    def comment(self):
+        return self.trajectory.comments[self.frame]
+
+class xyz_trajectory(_trajectory):
+
+    header_length = 2
+    index_fields = ('atoms_per_frame',)
+    text_fields = ('comments',)
+    frame_class = xyz_frame
+
+    def positions(self):
+        return self[self.frame].positions()
 
     def atom_types(self):    
-        frame = self.content[self.start_line_per_frame[self.frame]+2:self.start_line_per_frame[self.frame]+self.atoms_per_frame[self.frame]+2]
-        return numpy.array([line.split() for line in frame])[:,0].astype(str)
-    
-    def __iter__(self):
-        self.frame = 0
-        return self
+        return self[self.frame].atom_types()
 
-    def __next__(self):
-        if self.frame < self.n_frames-1:
-            if self.iteration_started:
-                self.frame += 1
-            self.iteration_started = True 
-            return self
-        else:
-            raise StopIteration
-    def __getitem__(self, x):
-        self.frame = x
-        return self
+    # Scans the frames starting at byte offset of file f. Only complete
+    # frames are indexed, a partially written last frame is ignored.
+    def _scan_frames(self, f, offset):
+        frame_offsets, data_offsets, headers = _scan_frames(f, offset, 2, 0, not self.follow)
+        atoms_per_frame = [int(header[0]) for header in headers]
+        comments = [header[1] for header in headers]
+        return {'frame_offsets': frame_offsets, 'data_offsets': data_offsets, 'atoms_per_frame': atoms_per_frame, 'comments': comments}
 
 #---------------------------------------------------
 # Class for trajectories in .xyz-fileformat.
@@ -87,52 +787,122 @@ class xyz_trajectory:
 # functions:
 #
 # <lammpstrj>.data() 		    -- data of the selected frame - numpy.array(M,N); N = number of atoms; M = number of logged properties
+# <lammpstrj>.data(columns=list) -- data of the selected columns only, by name or position e.g. ['x', 'y', 'z'] - numpy.array(K,N)
+# <lammpstrj>.data(dtype=dict)  -- data of the selected frame as record array, dtype per column e.g. {'id': int} - others float
+# <lammpstrj>.dtypes()  	    -- default dtype per column: int for id/type/mol/image flags, str for element (sized to the longest entry by data()), else float - dict
 # <lammpstrj>.columns()  	    -- columnnames of the logged properties - list(M)
 # <lammpstrj>.cell()		    -- pbcs of the selected frame  - list([xlo, xhi], [ylo, yhi], [zlo, zhi])
-# <lammpstrj>.df_frame()	    -- pandas DataFrame containg data+columns of selected timestep df(M,N)
+# <lammpstrj>.df_frame()	    -- pandas DataFrame containg data+columns of selected timestep df(M,N) - typed by dtypes()
+# <lammpstrj>.df_frame(columns=list) -- pandas DataFrame of the selected columns only
+# <lammpstrj>.map_frames(func)  -- [func(frame) for all frames] evaluated in a process pool - list
+# <lammpstrj>.refresh()         -- index frames appended since the last index - number of new frames
+# <lammpstrj>.tail()            -- iterate over all frames, waiting for new ones (async: atail())
+# <lammpstrj>[i]                -- frame i as lammpstrj_frame with data(), cell(), columns(), df_frame() and timestep
+# <lammpstrj>[a:b:c], [i, j]    -- list of lammpstrj_frame, adjacent frames are read at once
 #
 # porperties:
 #
-# <lammpstrj>.frame		        -- current selected frame - int
+# <lammpstrj>.frame		        -- frame used by data(), cell(), columns() and df_frame() of the trajectory - int
 # <lammpstrj>.n_frames		    -- number of total frames in trajectory - int
 # <lammpstrj>.atoms_per_frame	-- number of atoms per timestep - list()
 # <lammpstrj>.timesteps	        -- timestep of the logged frames - list()
-# <lammpstrj>.content		    -- raw content of file as list()
+# <lammpstrj>.content		    -- raw content of file as list() - None in 'stream' and 'mmap' mode
+# <lammpstrj>.frame_offsets	    -- byte offset of each frame, last entry marks the end of the last frame - numpy.array(n_frames+1)
+# <lammpstrj>.data_offsets	    -- byte offset of the first atom line of each frame - numpy.array(n_frames)
+#
+# modes:
+#
+# lammpstrj(filepath, mode='memory')    -- whole file is read into <lammpstrj>.content
+# lammpstrj(filepath, mode='stream')    -- only the frame offsets are indexed, each frame is read from disk on demand
+# lammpstrj(filepath, mode='mmap')      -- file is memory-mapped, frames are slices of the map shared between processes (copied once when parsed)
+# lammpstrj(filepath, index_file=True)  -- frame index is stored in/loaded from <filepath>.idx.npz
+# lammpstrj(filepath, cache_bytes=2**30)  -- parsed frames are kept in an LRU cache of 1 GB, see <lammpstrj>.cache
+# lammpstrj(filepath, follow=True)      -- file is still being written, a partial last frame is left for refresh()
 #---------------------------------------------------
 
-class lammpstrj:
+class lammpstrj_frame(_frame):
 
-    def __init__(self, filepath):
-        self.path = filepath
-        self.content = self.__file_content()
-        self.n_lines = len(self.content)
-        self.timesteps, self.atoms_per_frame = self.__get_traj_properties()
-        self.start_line_per_frame = numpy.hstack(([0], numpy.cumsum(numpy.array(self.atoms_per_frame) + 9)[:-1]))
-        self.n_frames = len(self.atoms_per_frame)
-        self.iteration_started = False
-        self.current_line = 0
-        self.__iter__()
-        self.__print()
+    __slots__ = ()
 
-    def data(self):
-        frame = self.content[self.start_line_per_frame[self.frame]+9:self.start_line_per_frame[self.frame]+self.atoms_per_frame[self.frame]+9]
-        return numpy.array([line.split() for line in frame]).astype(float)        
+    @property
+    def timestep(self):
+        return self.trajectory.timesteps[self.frame]
+
+    def data(self, columns=None, dtype=float):
+        names = self.columns()
+        usecols = self.__usecols(columns, names)
+        if usecols is not None:
+            names = [names[i] for i in usecols]
+        if isinstance(dtype, dict):
+            dtype = [(name, dtype.get(name, float)) for name in names]
+        key = ('data', repr(usecols), repr(dtype))
+        return self._cached(key, lambda: _parse_block(self._atom_block(), self.trajectory.atoms_per_frame[self.frame], len(names), usecols=usecols, dtype=dtype))
+
+    def dtypes(self):
+        dtypes = dict()
+        for name in self.columns():
+            if name in self.trajectory.integer_columns:
+                dtypes[name] = numpy.int64
+            elif name in self.trajectory.text_columns:
+                dtypes[name] = str
+            else:
+                dtypes[name] = numpy.float64
+        return dtypes
 
     def cell(self):
-        frame = self.content[self.start_line_per_frame[self.frame]+5:self.start_line_per_frame[self.frame]+8]
+        frame = self._header_lines()[5:8]
         return numpy.array([i.split() for i in frame]).astype(float).tolist()
 
     def columns(self):
-        frame = self.content[self.start_line_per_frame[self.frame]+8]        
+        frame = self._header_lines()[8]
         return frame.split()[2:]  
-    
-    def df_frame(self):
-        return pandas.DataFrame(data=self.data(), columns=self.columns())
 
-    def __file_content(self):
-        with open(self.path) as f:
-            contents = f.readlines()
-        return contents
+    def df_frame(self, columns=None):
+        import pandas
+        return pandas.DataFrame(data=self.data(columns=columns, dtype=self.dtypes()))
+
+    # Column selection by name (as in columns()) or by position.
+    def __usecols(self, columns, names):
+        if columns is None:
+            return None
+        if isinstance(columns, (str, int)):
+            columns = [columns]
+        usecols = list()
+        for column in columns:
+            if isinstance(column, str):
+                if column not in names:
+                    raise ValueError('Column "{column}" not found. Available columns: {names}'.format(column=column, names=names))
+                column = names.index(column)
+            usecols.append(int(column))
+        return usecols
+
+class lammpstrj(_trajectory):
+
+    header_length = 9
+    index_fields = ('timesteps', 'atoms_per_frame')
+    integer_columns = ('id', 'type', 'mol', 'proc', 'procp1', 'ix', 'iy', 'iz')
+    text_columns = ('element',)
+    frame_class = lammpstrj_frame
+
+    def __init__(self, filepath, mode='memory', index_file=False, cache_bytes=0, follow=False):
+        super().__init__(filepath, mode=mode, index_file=index_file, cache_bytes=cache_bytes, follow=follow)
+        self.current_line = 0
+        instrumentation.logger.info('Loaded LAMMPS trajectory file "%s" containing %d frames.', self.path, self.n_frames)
+
+    def data(self, columns=None, dtype=float):
+        return self[self.frame].data(columns=columns, dtype=dtype)
+
+    def dtypes(self):
+        return self[self.frame].dtypes()
+
+    def cell(self):
+        return self[self.frame].cell()
+
+    def columns(self):
+        return self[self.frame].columns()
+    
+    def df_frame(self, columns=None):
+        return self[self.frame].df_frame(columns=columns)
     
     def read_lines(self, lines_of_interest):
         self.current_line = 0
@@ -145,31 +915,10 @@ class lammpstrj:
                     self.current_line +=1
             return lines_to_return
 
-    def __get_traj_properties(self):
-        timesteps = list()
-        atoms_per_frame = list()
-        line = 0
-        while line < self.n_lines:
-            timesteps.append(int(self.content[line+1]))
-            atoms_per_frame.append(int(self.content[line+3]))
-            line = numpy.cumsum(numpy.array(atoms_per_frame)+9)[-1]
-        return timesteps, atoms_per_frame 
-
-    def __print(self):
-        print('Loaded LAMMPS trajectory file "{file}" containing {frames} frames.'.format(file=self.path, frames=self.n_frames))
-
-    def __iter__(self):
-        self.frame = 0
-        return self
-
-    def __next__(self):
-        if self.frame < self.n_frames-1:
-            if self.iteration_started:
-                self.frame += 1
-            self.iteration_started = True 
-            return self
-        else:
-            raise StopIteration
-    def __getitem__(self, x):
-        self.frame = x
-        return self
+    # Scans the frames starting at byte offset of file f. Only complete
+    # frames are indexed, a partially written last frame is ignored.
+    def _scan_frames(self, f, offset):
+        frame_offsets, data_offsets, headers = _scan_frames(f, offset, 9, 3, not self.follow)
+        timesteps = [int(header[1]) for header in headers]
+        atoms_per_frame = [int(header[3]) for header in headers]
+        return {'frame_offsets': frame_offsets, 'data_offsets': data_offsets, 'timesteps': timesteps, 'atoms_per_frame': atoms_per_frame}